@@ -0,0 +1,221 @@
+"""
+在合成数据集（见 synthetic.py）或随包发布的数据集上测量 get、dfs_filter、compute.score、compute.component、
+output.re_name、output.vis 及正向、逆向两个分析流程的耗时和内存峰值。
+
+用法：
+    python benchmarks/bench_pipeline.py [--scale 0.25 0.5 1] [--bundled] [--repeat 3] [--out results.json]
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+
+输出为 json：各规模的数据集的行数及各场景的最短耗时、中位耗时（秒）、内存峰值（字节）和行数；流程场景还包含各阶段
+的耗时。--compare 比较两次运行的结果，输出各场景耗时的比值（新/旧）。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+from herbiv import analysis, compute, dataset, get, instrument, output
+
+# 逆向分析的靶点数、正向分析的复方数
+N_PROTEINS = 5
+N_FORMULAS = 3
+
+
+def measure(function, setup, repeat):
+    """
+    测量一个场景
+    Args:
+        function: 以 setup 的返回值为参数的函数
+        setup: 生成输入的无参函数（不计入耗时）
+        repeat: 运行次数
+    Returns: 最短耗时、中位耗时、内存峰值（另外运行一次，使用 tracemalloc）、输入和输出的行数及最后一次运行的各阶段
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        with instrument.profile(memory=False) as stats:
+            start = time.perf_counter()
+            result = function(*args)
+            times.append(time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': min(times),
+        'median_seconds': statistics.median(times),
+        'peak_memory': peak,
+        'rows_in': rows(args),
+        'rows_out': rows(result if isinstance(result, (tuple, list)) else [result]),
+        'stages': {name: item['seconds'] for name, item in stats.summary().items() if name != 'total'},
+    }
+
+
+def rows(values):
+    # 各表的行数之和
+    return sum(len(value) for value in values if getattr(value, 'ndim', 0) == 2)
+
+
+def scenarios(rng, path):
+    # 各场景：名称 -> (函数, 生成输入的函数)；靶点和复方从有连接的节点中选取
+    proteins = list(rng.choice(dataset.load('chem_protein_links')['Ensembl_ID'].unique(), N_PROTEINS, replace=False))
+    formulas = list(rng.choice(dataset.load('formula_tcm_links')['HVPID'].unique(), N_FORMULAS, replace=False))
+
+    def reverse_tables():
+        # 逆向分析中get得到的各表
+        proteins_info = get.get_proteins('Ensembl_ID', proteins)
+        chem_protein_links = get.get_chem_protein_links('Ensembl_ID', proteins_info['Ensembl_ID'], 0)
+        chem = get.get_chemicals('HVCID', chem_protein_links['HVCID'])
+        tcm_chem_links = get.get_tcm_chem_links('HVCID', chem['HVCID'])
+        tcm = get.get_tcm('HVMID', tcm_chem_links['HVMID'])
+        formula_tcm_links = get.get_formula_tcm_links('HVMID', tcm['HVMID'])
+        formula = get.get_formula('HVPID', formula_tcm_links['HVPID'])
+        return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins_info
+
+    def filtered():
+        return analysis.dfs_filter(*reverse_tables())
+
+    def scored():
+        formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins_info = filtered()
+        tcm, chem, formula = compute.score(tcm, tcm_chem_links, chem, chem_protein_links, formula,
+                                           formula_tcm_links)
+        return tcm, tcm_chem_links, chem, chem_protein_links, proteins_info
+
+    def cold_load():
+        dataset.clear()
+        return ()
+
+    return {
+        'dataset.load': (lambda: dataset.load(), cold_load),
+        'get': (reverse_tables, lambda: ()),
+        'analysis.dfs_filter': (lambda *tables: analysis.dfs_filter(*tables), reverse_tables),
+        'compute.score': (lambda *tables: compute.score(*tables), lambda: _score_args(filtered())),
+        'compute.component': (lambda tcm: compute.component(tcm, random_state=0, num=100),
+                              lambda: (scored()[0],)),
+        'output.re_name': (lambda *tables: output.re_name(*tables), scored),
+        'output.vis': (lambda *tables: output.vis(*tables, path=path), scored),
+        'analysis.from_tcm_or_formula': (
+            lambda: analysis.from_tcm_or_formula(formulas, score=400, out_for_cytoscape=False, out_graph=False),
+            lambda: ()),
+        'analysis.from_proteins': (
+            lambda: analysis.from_proteins(proteins, score=0, random_state=0, num=100, out_for_cytoscape=False),
+            lambda: ()),
+    }
+
+
+def _score_args(tables):
+    # dfs_filter的返回值按compute.score的参数顺序排列
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins_info = tables
+    return tcm, tcm_chem_links, chem, chem_protein_links, formula, formula_tcm_links
+
+
+def run(data_dir, repeat, seed, selected=None):
+    # 在data_dir中的数据集上运行各场景
+    dataset.set_data_dir(data_dir)
+    compute.tcm_score_cache().clear()
+    sizes = {name: len(dataset.load(name)) for name in dataset.DATASETS}
+
+    results = {}
+    path = tempfile.mkdtemp(prefix='herbiv-bench-')
+    try:
+        for name, (function, setup) in scenarios(np.random.default_rng(seed), path).items():
+            if selected and name not in selected:
+                continue
+            try:
+                results[name] = measure(function, setup, repeat)
+            except ImportError as e:
+                # 如未安装pyecharts
+                results[name] = {'skipped': str(e)}
+            print(f'{name}: {results[name].get("seconds", "skipped")}', file=sys.stderr)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        dataset.set_data_dir()
+
+    return {'rows': sizes, 'scenarios': results}
+
+
+def environment():
+    # 运行环境及代码版本
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import pandas
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pandas.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(old, new):
+    # 各场景耗时的比值（新/旧）
+    ratios = {}
+    for key, item in new['datasets'].items():
+        before = old['datasets'].get(key, {}).get('scenarios', {})
+        for name, result in item['scenarios'].items():
+            if 'seconds' in result and 'seconds' in before.get(name, {}):
+                ratios[f'{key} {name}'] = round(result['seconds'] / before[name]['seconds'], 3)
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, nargs='+', default=[0.25, 1.0],
+                        help='合成数据集各层节点数相对于随包发布的数据集的倍数')
+    parser.add_argument('--degree', choices=synthetic.DEGREES, default='powerlaw', help='合成数据集的度数分布')
+    parser.add_argument('--bundled', action='store_true', help='同时在随包发布的数据集上运行')
+    parser.add_argument('--scenario', nargs='+', help='仅运行这些场景')
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景的运行次数')
+    parser.add_argument('--seed', type=int, default=0, help='生成数据集及选取靶点和复方的随机数种子')
+    parser.add_argument('--out', type=str, help='将结果写入该文件（默认输出至标准输出）')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比较两次运行的结果')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f, open(args.compare[1], encoding='utf-8') as g:
+            print(json.dumps(compare(json.load(f), json.load(g)), indent=4, ensure_ascii=False))
+        return
+
+    report = {'environment': environment(), 'repeat': args.repeat, 'seed': args.seed, 'datasets': {}}
+    if args.bundled:
+        report['datasets']['bundled'] = run(dataset.DEFAULT_DATA_DIR, args.repeat, args.seed, args.scenario)
+
+    for scale in args.scale:
+        directory = tempfile.mkdtemp(prefix='herbiv-synthetic-')
+        try:
+            synthetic.generate(directory, scale, args.degree, seed=args.seed)
+            item = run(directory, args.repeat, args.seed, args.scenario)
+            item.update({'scale': scale, 'degree': args.degree})
+            report['datasets'][f'synthetic-{args.degree}-{scale:g}'] = item
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    text = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
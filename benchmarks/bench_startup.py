@@ -0,0 +1,65 @@
+"""
+测量 herbiv 的导入和 herbiv-cli.py 的启动耗时，并检查可视化和优化模型的依赖是否被提前导入。
+
+用法：
+    python benchmarks/bench_startup.py [--repeat 5] [--max-ms 1000]
+
+输出为 json，各项为多次运行的最短耗时（毫秒）；任一项超过 --max-ms 或提前导入了依赖时以非零状态码退出。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'herbiv-cli.py')
+
+# 各场景及其命令
+SCENARIOS = {
+    'import herbiv': [sys.executable, '-c', 'import herbiv'],
+    'import herbiv.analysis': [sys.executable, '-c', 'import herbiv.analysis'],
+    'cli --help': [sys.executable, CLI, '--help'],
+    'cli wrong id': [sys.executable, CLI, '--function', 'tcm', '--tcms', 'WRONG'],
+}
+
+# 导入herbiv.analysis后不应被导入的模块
+DEFERRED = ['pyecharts', 'tqdm']
+
+
+def measure(command, repeat):
+    # 多次运行命令，返回最短耗时（毫秒）
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 1)
+
+
+def deferred_imports():
+    # 导入herbiv.analysis后已被导入的、本应延迟导入的模块
+    code = ('import sys, json, herbiv.analysis; '
+            f'print(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))')
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='每个场景的运行次数')
+    parser.add_argument('--max-ms', type=float, help='各场景耗时的上限（毫秒）')
+    args = parser.parse_args()
+
+    results = {name: measure(command, args.repeat) for name, command in SCENARIOS.items()}
+    loaded = deferred_imports()
+    print(json.dumps({'ms': results, 'eagerly_imported': loaded}, indent=4, ensure_ascii=False))
+
+    slow = [name for name, ms in results.items() if args.max_ms is not None and ms > args.max_ms]
+    if slow or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
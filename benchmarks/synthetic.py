@@ -0,0 +1,188 @@
+"""
+生成与 herbiv/data 中各数据集格式相同的合成复方-中药-化合物-蛋白网络，用于在不同规模的数据上测量性能。
+
+用法：
+    python benchmarks/synthetic.py OUT_DIR [--scale 1] [--degree powerlaw] [--seed 0] [--snapshot]
+
+各层节点数默认与随包发布的数据集相同（按 --scale 缩放）；各节点连接的下层节点数服从指定的分布，下层节点被连接的
+概率服从幂律分布（少数常用的中药、化合物和蛋白连接了大量的上层节点）。
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# 随包发布的数据集中各层的节点数
+SIZES = {'formula': 6191, 'tcm': 4666, 'chemicals': 6847, 'proteins': 14180}
+
+# 随包发布的数据集中各层节点连接的下层节点数的平均值
+MEAN_DEGREES = {'formula_tcm_links': 4.6, 'tcm_chem_links': 13.0, 'chem_protein_links': 47.0}
+
+# 各数据集的列（与herbiv/data中的文件相同）
+COLUMNS = {
+    'formula': ['HVPID', 'name', 'Prescription Composition', 'Instructions', 'Treatment Symptoms',
+                'Source Document'],
+    'formula_tcm_links': ['HVPID', 'HVMID'],
+    'tcm': ['HVMID', 'cn_name', 'pinyin_name', 'en_name', 'latin_name', 'Properties', 'Meridians', 'UsePart',
+            'Function', 'Indication', 'Toxicity', 'Clinical_manifestations', 'Therapeutic_en_class',
+            'Therapeutic_cn_class', 'HERB_id', 'TCMID_id', 'TCM_ID_id', 'SymMap_id', 'TCMSP_id'],
+    'tcm_chem_links': ['HVMID', 'HVCID'],
+    'chemicals': ['HVCID', 'Name', 'SMILES', 'CAS_id', 'PubChem_id', 'DrugBank_id', 'STITCH_id', 'HERB_id'],
+    'chem_protein_links': ['HVCID', 'Ensembl_ID', 'Combined_score'],
+    'proteins': ['Ensembl_ID', 'protein_name', 'gene_name'],
+}
+
+# 各数据集的文件名
+FILES = {
+    'formula': 'HerbiV_formula.csv',
+    'formula_tcm_links': 'HerbiV_formula_tcm_links.csv',
+    'tcm': 'HerbiV_tcm.csv',
+    'tcm_chem_links': 'HerbiV_tcm_chemical_links.csv',
+    'chemicals': 'HerbiV_chemicals.csv',
+    'chem_protein_links': 'HerbiV_chemical_protein_links.csv',
+    'proteins': 'HerbiV_proteins.csv',
+}
+
+DEGREES = ('powerlaw', 'uniform')
+
+
+def ids(prefix, n, width=4):
+    # 按序编号的ID，如HVM0000
+    width = max(width, len(str(max(n - 1, 0))))
+    return np.char.add(prefix, np.char.zfill(np.arange(n).astype(str), width)).astype(object)
+
+
+def degrees(rng, n, mean, kind, exponent=2.5):
+    # 各节点连接的下层节点数（至少为1），平均值约为mean
+    if kind == 'uniform':
+        values = rng.poisson(mean - 1, n) + 1
+    else:
+        # 截断的帕累托分布：多数节点的度数较小，少数节点的度数很大
+        values = (rng.pareto(exponent - 1, n) + 1) * (mean * (exponent - 2) / (exponent - 1))
+        values = np.maximum(np.rint(values), 1).astype(np.int64)
+    return values
+
+
+def links(rng, n_source, n_target, mean, kind, exponent=2.5):
+    # 各上层节点与下层节点之间不重复的连接（上层节点的编号、下层节点的编号）
+    counts = np.minimum(degrees(rng, n_source, mean, kind, exponent), n_target)
+    source = np.repeat(np.arange(n_source), counts)
+    if kind == 'uniform':
+        popularity = np.full(n_target, 1 / n_target)
+    else:
+        # 下层节点被连接的概率服从幂律分布，编号被打乱以免常用节点集中在编号较小的一端
+        popularity = rng.permutation(1 / np.arange(1, n_target + 1) ** (1 / (exponent - 1)))
+        popularity /= popularity.sum()
+    target = rng.choice(n_target, size=len(source), p=popularity)
+    pairs = np.unique(np.stack([source, target], axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def generate(directory, scale=1.0, degree='powerlaw', exponent=2.5, seed=0, sizes=None, mean_degrees=None,
+             snapshot=False):
+    """
+    生成合成数据集并写入 directory
+    Args:
+        directory: 存放数据集的目录（可通过 herbiv.dataset.set_data_dir 使用）
+        scale: 各层节点数相对于 sizes 的倍数
+        degree: 'powerlaw' - 度数及被连接的概率服从幂律分布；'uniform' - 度数服从泊松分布，下层节点被等概率连接
+        exponent: 幂律分布的指数（大于2）
+        seed: 随机数种子，相同的参数和种子生成相同的数据集
+        sizes: 各层的节点数，默认为 SIZES
+        mean_degrees: 各层节点连接的下层节点数的平均值，默认为 MEAN_DEGREES
+        snapshot: 是否同时编译二进制快照（见 herbiv.dataset.compile_snapshot）
+    Returns: 各数据集的行数
+    """
+    rng = np.random.default_rng(seed)
+    sizes = {name: max(int(round(n * scale)), 1) for name, n in (sizes or SIZES).items()}
+    mean_degrees = dict(MEAN_DEGREES, **(mean_degrees or {}))
+
+    formula_ids = ids('HVP', sizes['formula'])
+    tcm_ids = ids('HVM', sizes['tcm'])
+    chem_ids = ids('HVC', sizes['chemicals'])
+    protein_ids = ids('ENSP', sizes['proteins'], 11)
+
+    tables = {}
+    n = sizes['formula']
+    tables['formula'] = pd.DataFrame({
+        'HVPID': formula_ids,
+        'name': np.char.add('方', np.arange(n).astype(str)).astype(object),
+        'Prescription Composition': np.where(rng.random(n) < 0.9, '合成复方', None),
+        'Instructions': None,
+        'Treatment Symptoms': 'No Data.[无数据]',
+        'Source Document': np.where(rng.random(n) < 0.5, '《合成》', None),
+    })
+
+    n = sizes['tcm']
+    tables['tcm'] = pd.DataFrame({column: None for column in COLUMNS['tcm']}, index=range(n))
+    tables['tcm']['HVMID'] = tcm_ids
+    tables['tcm']['cn_name'] = np.char.add('药', np.arange(n).astype(str)).astype(object)
+    tables['tcm']['pinyin_name'] = np.char.add('YAO ', np.arange(n).astype(str)).astype(object)
+    tables['tcm']['en_name'] = np.char.add('Herb ', np.arange(n).astype(str)).astype(object)
+    tables['tcm']['HERB_id'] = ids('HERB', n, 6)
+    tables['tcm']['TCM_ID_id'] = np.where(rng.random(n) < 0.7, rng.integers(1, 10000, n), np.nan)
+
+    n = sizes['chemicals']
+    tables['chemicals'] = pd.DataFrame({
+        'HVCID': chem_ids,
+        'Name': np.char.add('compound ', np.arange(n).astype(str)).astype(object),
+        'SMILES': 'C',
+        'CAS_id': None,
+        'PubChem_id': np.where(rng.random(n) < 0.5, rng.integers(1, 10 ** 6, n), np.nan),
+        'DrugBank_id': None,
+        'STITCH_id': np.char.add('CIDm', np.char.zfill(np.arange(n).astype(str), 8)).astype(object),
+        'HERB_id': ids('HBIN', n, 6),
+    })
+
+    n = sizes['proteins']
+    tables['proteins'] = pd.DataFrame({
+        'Ensembl_ID': protein_ids,
+        'protein_name': np.char.add('Protein ', np.arange(n).astype(str)).astype(object),
+        'gene_name': np.char.add('GENE', np.arange(n).astype(str)).astype(object),
+    })
+
+    source, target = links(rng, sizes['formula'], sizes['tcm'], mean_degrees['formula_tcm_links'], degree, exponent)
+    tables['formula_tcm_links'] = pd.DataFrame({'HVPID': formula_ids[source], 'HVMID': tcm_ids[target]})
+
+    source, target = links(rng, sizes['tcm'], sizes['chemicals'], mean_degrees['tcm_chem_links'], degree, exponent)
+    tables['tcm_chem_links'] = pd.DataFrame({'HVMID': tcm_ids[source], 'HVCID': chem_ids[target]})
+
+    source, target = links(rng, sizes['chemicals'], sizes['proteins'], mean_degrees['chem_protein_links'], degree,
+                           exponent)
+    # STITCH的combined_score在150-999之间，多数连接的分数较低
+    scores = 150 + np.rint(rng.beta(1.2, 3.0, len(source)) * 849).astype(np.int64)
+    tables['chem_protein_links'] = pd.DataFrame({'HVCID': chem_ids[source], 'Ensembl_ID': protein_ids[target],
+                                                 'Combined_score': scores})
+
+    os.makedirs(directory, exist_ok=True)
+    for name, table in tables.items():
+        table[COLUMNS[name]].to_csv(os.path.join(directory, FILES[name]), index=False)
+
+    if snapshot:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from herbiv import dataset
+        dataset.set_data_dir(directory)
+        dataset.compile_snapshot()
+
+    return {name: len(table) for name, table in tables.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='存放数据集的目录')
+    parser.add_argument('--scale', type=float, default=1.0, help='各层节点数相对于随包发布的数据集的倍数')
+    parser.add_argument('--degree', choices=DEGREES, default='powerlaw', help='度数分布')
+    parser.add_argument('--exponent', type=float, default=2.5, help='幂律分布的指数（大于2）')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--snapshot', action='store_true', help='同时编译二进制快照')
+    args = parser.parse_args()
+
+    rows = generate(args.directory, args.scale, args.degree, args.exponent, args.seed, snapshot=args.snapshot)
+    print(json.dumps(rows, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/python3
+from __future__ import annotations
+import os
+import sys
 import json
 import argparse
-import numpy as np
-import pandas as pd
-from herbiv import analysis
 import warnings
+from typing import TYPE_CHECKING
+# pandas 和 herbiv 仅在执行分析时导入，查看帮助和检查 ID 时无需等待其加载
+if TYPE_CHECKING:
+    import pandas as pd
 # 消除 pandas Future Warning
 warnings.simplefilter(action='ignore', category=FutureWarning)
 """
@@ -64,71 +68,120 @@ def json_prettier(json_str: str):
     print(pretty_json)
 
 
-def nan_converter(data: pd.DataFrame):
+# --format 支持的格式及其文件扩展名
+FORMATS = {"json": None, "csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+def table_to_json(data: pd.DataFrame, layout: str = 'records') -> str:
     """
-    为了解决 json 不支持 NaN 的问题，将 data 中的 NaN 转化为 None
+    将 DataFrame 直接按列转化为 json 字符串，NaN 转化为 null
     Args:
-        data:
-    Returns:
+        data: 需转化的表
+        layout: 'records' - 每行一个对象的列表；'columns' - {"columns": 列名列表, "data": 各列的值的列表}
+    Returns: json 字符串
     """
-    data.replace(np.nan, None, inplace=True)
-    return data.where((data.applymap(lambda x: True if str(x) != 'nan' else False)), None)
+    if layout == 'columns':
+        return '{"columns": %s, "data": [%s]}' % (
+            json.dumps([str(column) for column in data.columns]),
+            ', '.join(data[column].to_json(orient='records', double_precision=15) for column in data.columns))
+    return data.to_json(orient='records', double_precision=15)
+
+
+def serialize(tables: dict, path: str, layout: str = 'records', fmt: str = 'json') -> str:
+    """
+    输出分析结果的各表
+    Args:
+        tables: 表名与表的对应关系
+        path: fmt 不为 json 时存放各表文件的目录
+        layout: json 的布局，见 table_to_json
+        fmt: 'json' - 返回包含各表的 json 字符串；'csv'、'parquet'、'feather' - 将各表分别写入 path 中的文件，
+             返回包含各文件路径的 json 字符串（parquet 和 feather 需要安装 pyarrow）
+    Returns: json 字符串
+    """
+    from herbiv import instrument
+    with instrument.stage('cli.serialize', sum(len(table) for table in tables.values() if table is not None)):
+        return _serialize(tables, path, layout, fmt)
+
 
+def _serialize(tables: dict, path: str, layout: str, fmt: str) -> str:
+    if fmt not in FORMATS:
+        return json.dumps({'msg': 'Wrong format'})
+    if layout not in ('records', 'columns'):
+        return json.dumps({'msg': 'Wrong layout'})
 
-def from_tcm(tcms: list[str], score: int, path: str):
+    if fmt == 'json':
+        return '{%s}' % ', '.join('%s: %s' % (json.dumps(name), table_to_json(table, layout))
+                                  for name, table in tables.items())
+
+    os.makedirs(path, exist_ok=True)
+    files = {}
+    for name, table in tables.items():
+        files[name] = os.path.join(path, name + FORMATS[fmt])
+        try:
+            if fmt == 'csv':
+                table.to_csv(files[name], index=False)
+            else:
+                getattr(table.reset_index(drop=True), 'to_' + fmt)(files[name])
+        except ImportError as e:
+            return json.dumps({'msg': str(e)})
+    return json.dumps({'msg': 'ok', 'files': files})
+
+
+def from_tcm(tcms: list[str], score: int, path: str, layout: str = 'records', fmt: str = 'json'):
     """
     给定中药分析
     Args:
         tcms: 中药 id 列表, 如 ['HVM0367', 'HVM1695']
         score:
         path: 图像输出路径
+        layout: json 的布局，见 table_to_json
+        fmt: 输出格式，见 serialize
     Returns:
     """
     if not check_id(tcms, check_tcm_id):
         return json.dumps({'msg': 'Wrong TCM ID'})
-    result = analysis.from_tcm_or_formula(tcms, score=score, path=path)
-    tmp = []
-    for e in result:
-        tmp.append(nan_converter(e))
-    tcm, tcm_chem_links, chem, chem_protein_links, proteins = tmp
+    from herbiv import analysis
+    tcm, tcm_chem_links, chem, chem_protein_links, proteins = \
+        analysis.from_tcm_or_formula(tcms, score=score, path=path)
 
-    return json.dumps({
-        'tcm':               tcm.to_dict(orient='records'),
-        'tcm_chem_link':     tcm_chem_links.to_dict(orient='records'),
-        'chem':              chem.to_dict(orient='records'),
-        'chem_protein_link': chem_protein_links.to_dict(orient='records'),
-        'protein':           proteins.to_dict(orient='records')
-    })
+    return serialize({
+        'tcm':               tcm,
+        'tcm_chem_link':     tcm_chem_links,
+        'chem':              chem,
+        'chem_protein_link': chem_protein_links,
+        'protein':           proteins
+    }, path, layout, fmt)
 
 
-def from_formula(formulas: list[str], score: int, path):
+def from_formula(formulas: list[str], score: int, path, layout: str = 'records', fmt: str = 'json'):
     """
     给定复方分析
     Args:
         formulas: 复方 id 列表, 如 ['HVP1625']
         score:
         path:     图像输出路径
+        layout:   json 的布局，见 table_to_json
+        fmt:      输出格式，见 serialize
     Returns:
     """
     if not check_id(formulas, check_formula_id):
         return json.dumps({'msg': 'Wrong formula ID'})
-    result = analysis.from_tcm_or_formula(formulas, score=score, path=path)
-    tmp = []
-    for e in result:
-        tmp.append(nan_converter(e))
-    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = tmp
-    return json.dumps({
-        'formula':            formula.to_dict(orient='records'),
-        'formula_tcm_links':  formula_tcm_links.to_dict(orient='records'),
-        'tcm':                tcm.to_dict(orient='records'),
-        'tcm_chem_links':     tcm_chem_links.to_dict(orient='records'),
-        'chem':               chem.to_dict(orient='records'),
-        'chem_protein_links': chem_protein_links.to_dict(orient='records'),
-        'proteins':           proteins.to_dict(orient='records'),
-    })
-
-
-def from_tcm_protein(tcms: list[str], proteins: list[str], score: int, path):
+    from herbiv import analysis
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = \
+        analysis.from_tcm_or_formula(formulas, score=score, path=path)
+    return serialize({
+        'formula':            formula,
+        'formula_tcm_links':  formula_tcm_links,
+        'tcm':                tcm,
+        'tcm_chem_links':     tcm_chem_links,
+        'chem':               chem,
+        'chem_protein_links': chem_protein_links,
+        'proteins':           proteins,
+    }, path, layout, fmt)
+
+
+def from_tcm_protein(tcms: list[str], proteins: list[str], score: int, path, layout: str = 'records',
+                     fmt: str = 'json'):
     """
     给定中药和靶点分析
     Args:
@@ -136,32 +189,32 @@ def from_tcm_protein(tcms: list[str], proteins: list[str], score: int, path):
         proteins: 靶点 id 列表，如 ['ENSP00000043402', 'ENSP00000223366']
         score:
         path:
+        layout:   json 的布局，见 table_to_json
+        fmt:      输出格式，见 serialize
     Returns:
     """
     if not check_id(tcms, check_tcm_id):
         return json.dumps({'msg': 'Wrong TCM ID'})
     if not check_id(proteins, check_protein_id):
         return json.dumps({'msg': 'Wrong protein ID'})
-    result = analysis.from_tcm_or_formula(
+    from herbiv import analysis
+    tcm, tcm_chem_links, chem, chem_protein_links, proteins = analysis.from_tcm_or_formula(
         tcm_or_formula_id=tcms,
         proteins_id=proteins,
         path=path,
         score=score
     )
-    tmp = []
-    for e in result:
-        tmp.append(nan_converter(e))
-    tcm, tcm_chem_links, chem, chem_protein_links, proteins = tmp
-    return json.dumps({
-        'tcm': tcm.to_dict(orient='records'),
-        'tcm_chem_link': tcm_chem_links.to_dict(orient='records'),
-        'chem': chem.to_dict(orient='records'),
-        'chem_protein_link': chem_protein_links.to_dict(orient='records'),
-        'protein': proteins.to_dict(orient='records')
-    })
+    return serialize({
+        'tcm': tcm,
+        'tcm_chem_link': tcm_chem_links,
+        'chem': chem,
+        'chem_protein_link': chem_protein_links,
+        'protein': proteins
+    }, path, layout, fmt)
 
 
-def from_formula_protein(formulas: list[str], proteins: list[str], score: int, path):
+def from_formula_protein(formulas: list[str], proteins: list[str], score: int, path, layout: str = 'records',
+                         fmt: str = 'json'):
     """
     给定复方和靶点分析
     Args:
@@ -169,90 +222,302 @@ def from_formula_protein(formulas: list[str], proteins: list[str], score: int, p
         proteins: 靶点 id 列表，如 ['ENSP00000381588', 'ENSP00000252519']
         score:
         path:
+        layout:   json 的布局，见 table_to_json
+        fmt:      输出格式，见 serialize
     Returns:
     """
     if not check_id(formulas, check_formula_id):
         return json.dumps({'msg': 'Wrong formula ID'})
     if not check_id(proteins, check_protein_id):
         return json.dumps({'msg': 'Wrong protein ID'})
-    result = analysis.from_tcm_or_formula(
-        tcm_or_formula_id=formulas,
-        proteins_id=proteins,
-        path=path,
-        score=score
-    )
-    tmp = []
-    for e in result:
-        tmp.append(nan_converter(e))
-    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = tmp
-    return json.dumps({
-        'formula':            formula.to_dict(orient='records'),
-        'formula_tcm_links':  formula_tcm_links.to_dict(orient='records'),
-        'tcm':                tcm.to_dict(orient='records'),
-        'tcm_chem_links':     tcm_chem_links.to_dict(orient='records'),
-        'chem':               chem.to_dict(orient='records'),
-        'chem_protein_links': chem_protein_links.to_dict(orient='records'),
-        'proteins':           proteins.to_dict(orient='records'),
-    })
-
-
-def from_protein(proteins: list[str], score: int, path):
+    from herbiv import analysis
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = \
+        analysis.from_tcm_or_formula(
+            tcm_or_formula_id=formulas,
+            proteins_id=proteins,
+            path=path,
+            score=score
+        )
+    return serialize({
+        'formula':            formula,
+        'formula_tcm_links':  formula_tcm_links,
+        'tcm':                tcm,
+        'tcm_chem_links':     tcm_chem_links,
+        'chem':               chem,
+        'chem_protein_links': chem_protein_links,
+        'proteins':           proteins,
+    }, path, layout, fmt)
+
+
+def from_protein(proteins: list[str], score: int, path, layout: str = 'records', fmt: str = 'json'):
     """
     逆向网络药理学分析
     Args:
         proteins: 靶点 id 列表，如 ['ENSP00000381588', 'ENSP00000252519']
         score:
         path:
+        layout:   json 的布局，见 table_to_json
+        fmt:      输出格式，见 serialize
     Returns:
     """
     if not check_id(proteins, check_protein_id):
         return json.dumps({'msg': 'Wrong protein ID'})
+    from herbiv import analysis
     # 优化
-    result = analysis.from_proteins(
-        proteins,
-        score=score,
-        random_state=138192,
-        num=100,
-        path=path
-    )
-    tmp = []
-    for e in result:
-        tmp.append(nan_converter(e))
-    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas = tmp
-    return json.dumps({
-        'formula':            formula.to_dict(orient='records'),
-        'formula_tcm_links':  formula_tcm_links.to_dict(orient='records'),
-        'tcm':                tcm.to_dict(orient='records'),
-        'tcm_chem_links':     tcm_chem_links.to_dict(orient='records'),
-        'chem':               chem.to_dict(orient='records'),
-        'chem_protein_links': chem_protein_links.to_dict(orient='records'),
-        'proteins':           proteins.to_dict(orient='records'),
-        'tcms':               tcms.to_dict(orient='records'),
-        'formulas':           formulas.to_dict(orient='records')
-    })
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas = \
+        analysis.from_proteins(
+            proteins,
+            score=score,
+            random_state=138192,
+            num=100,
+            path=path
+        )
+    return serialize({
+        'formula':            formula,
+        'formula_tcm_links':  formula_tcm_links,
+        'tcm':                tcm,
+        'tcm_chem_links':     tcm_chem_links,
+        'chem':               chem,
+        'chem_protein_links': chem_protein_links,
+        'proteins':           proteins,
+        'tcms':               tcms,
+        'formulas':           formulas
+    }, path, layout, fmt)
+
+
+# --function 与处理函数及其所需参数的对应关系
+FUNCTIONS = {
+    "tcm":             (from_tcm, ("tcms",)),
+    "formula":         (from_formula, ("formulas",)),
+    "protein":         (from_protein, ("proteins",)),
+    "tcm_protein":     (from_tcm_protein, ("tcms", "proteins")),
+    "formula_protein": (from_formula_protein, ("formulas", "proteins")),
+}
+
+
+def run(request: dict) -> str:
+    """
+    执行一个请求
+    Args:
+        request: 与命令行参数同名的键值对，如 {"function": "tcm", "tcms": ["HVM0367"], "score": 990, "path": "result"}，
+                 可选的 "layout" 和 "format" 见 serialize
+    Returns: 与命令行输出相同的 json 字符串
+    """
+    if request.get("function") not in FUNCTIONS:
+        return json.dumps({'msg': 'Wrong function'})
+    function, names = FUNCTIONS[request["function"]]
+    return function(*[request.get(name) for name in names],
+                    int(request.get("score", 990)), request.get("path", "result"),
+                    request.get("layout", "records"), request.get("format", "json"))
+
+
+def warm_up():
+    """
+    预先读取数据集并建立各层之间的邻接索引，之后的请求均直接使用内存中的数据
+    """
+    from herbiv import dataset, graph
+
+    dataset.load()
+    for source, target in zip(graph.LAYERS, graph.LAYERS[1:]):
+        graph.adjacency(source, target)
+        graph.adjacency(target, source)
+
+
+def serve(host: str, port: int):
+    """
+    启动常驻的分析服务：数据集和索引只在启动时读取一次，之后的请求均直接使用内存中的数据
+    请求为 POST 到 / 的 json（与 run 的参数相同），响应为与命令行输出相同的 json；GET /health 用于检查服务是否可用
+    Args:
+        host: 监听的地址
+        port: 监听的端口
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Lock
+
+    warm_up()
+
+    # 分析会写入结果文件，同一时间只执行一个请求
+    lock = Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: str):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, json.dumps({'msg': 'ok'}))
+            else:
+                self._send(404, json.dumps({'msg': 'Not found'}))
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self._send(400, json.dumps({'msg': 'Invalid json'}))
+                return
+            try:
+                with lock:
+                    status, body = 200, run(request)
+            except Exception as e:
+                status, body = 500, json.dumps({'msg': str(e)})
+            self._send(status, body)
+
+    with ThreadingHTTPServer((host, port), Handler) as server:
+        server.serve_forever()
+
+
+def batch(lines, workers: int = None, out=sys.stdout):
+    """
+    批量执行请求：每行一个 json 格式的请求（与 run 的参数相同），每个请求完成后立即输出一行
+    {"line": 行号, "result": 与命令行输出相同的 json}，同一时间最多有 2 * workers 个请求在执行或等待输出，内存占用不随请求数增长；
+    未指定 "path" 的请求的结果文件写入各自的 result/line-<行号> 目录，以免同时执行的请求互相覆盖
+    Args:
+        lines: 请求所在的各行，如打开的 jsonl 文件
+        workers: 并行执行请求的进程数，默认为 None（在当前进程中依次执行）；多进程时结果按完成的顺序输出
+        out: 输出结果的文件对象，默认为标准输出
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    # 子进程由当前进程派生时可直接使用已读取的数据集
+    warm_up()
+    requests = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+    if workers is None or workers <= 1:
+        for number, line in requests:
+            out.write(batch_line(number, line))
+            out.flush()
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for number, line in requests:
+            pending.add(executor.submit(batch_line, number, line))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    out.write(future.result())
+                out.flush()
+        for future in wait(pending).done:
+            out.write(future.result())
+        out.flush()
+
+
+def batch_line(number: int, line: str) -> str:
+    """
+    执行 batch 中的一个请求，返回输出的一行
+    Args:
+        number: 请求所在的行号
+        line: json 格式的请求
+    Returns: {"line": 行号, "result": 与命令行输出相同的 json}
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return '{"line": %d, "result": %s}\n' % (number, json.dumps({'msg': f'Invalid request: {e}'}))
+
+    try:
+        # 未指定结果目录时每行使用单独的目录
+        if isinstance(request, dict) and "path" not in request:
+            request["path"] = os.path.join("result", f"line-{number}")
+        result = run(request)
+    except Exception as e:
+        result = json.dumps({'msg': str(e)})
+    return '{"line": %d, "result": %s}\n' % (number, result)
+
+
+def request_server(url: str, request: dict) -> str:
+    """
+    将请求发送至 serve 启动的服务
+    Args:
+        url: 服务的地址，如 http://127.0.0.1:8765
+        request: 与 run 的参数相同
+    Returns: 服务返回的 json 字符串
+    """
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    data = json.dumps(request).encode('utf-8')
+    try:
+        with urlopen(Request(url, data=data, headers={'Content-Type': 'application/json'})) as response:
+            return response.read().decode('utf-8')
+    except HTTPError as e:
+        return e.read().decode('utf-8')
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--function', "-f", choices=["tcm", "formula", "protein", "tcm_protein", "formula_protein"], required=True, help='Functions')
+    parser.add_argument('--function', "-f", choices=list(FUNCTIONS), help='Functions')
     parser.add_argument('--tcms', nargs="+", type=str, help='TCM ids')
     parser.add_argument('--formulas', nargs="+", type=str, help='Formula ids')
     parser.add_argument('--proteins', nargs="+", type=str, help='Protein ids')
     parser.add_argument('--path', "-p", type=str, help='Graph Output Path', default="result")
     parser.add_argument('--prettier', action='store_true', help='输出格式化的 json')
     parser.add_argument('--score', "-s", type=int, default=990, help='分数')
+    parser.add_argument('--serve', action='store_true', help='启动常驻的分析服务')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='分析服务监听的地址')
+    parser.add_argument('--port', type=int, default=8765, help='分析服务监听的端口')
+    parser.add_argument('--server', type=str, help='将请求发送至分析服务，如 http://127.0.0.1:8765')
+    parser.add_argument('--batch', type=str, help='批量执行 jsonl 文件中的请求（- 表示标准输入），结果以 jsonl 格式输出')
+    parser.add_argument('--workers', type=int, help='批量执行请求的进程数')
+    parser.add_argument('--layout', choices=["records", "columns"], default="records",
+                        help='json 的布局：records - 每行一个对象；columns - {"columns": ..., "data": ...} 按列存储')
+    parser.add_argument('--format', choices=list(FORMATS), default="json",
+                        help='输出格式：json 输出至标准输出；csv、parquet、feather 将各表写入 --path 目录')
+    parser.add_argument('--profile', action='store_true',
+                        help='记录各阶段的耗时、内存峰值及行数，以 json 格式输出至标准错误')
     args = parser.parse_args()
 
-    if args.function == "tcm":
-        print(from_tcm(args.tcms, args.score, args.path))
-    elif args.function == "formula":
-        print(from_formula(args.formulas, args.score, args.path))
-    elif args.function == "tcm_protein":
-        print(from_tcm_protein(args.tcms, args.proteins, args.score, args.path))
-    elif args.function == "formula_protein":
-        print(from_formula_protein(args.formulas, args.proteins, args.score, args.path))
-    elif args.function == "protein":
-        print(from_protein(args.proteins, args.score, args.path))
+    # 服务在其他线程中处理请求且不会正常结束，多进程批量执行时各阶段记录在子进程中，均无法记录
+    if args.profile and args.serve:
+        parser.error("--profile cannot be used with --serve")
+    if args.profile and args.batch is not None and args.workers is not None and args.workers > 1:
+        parser.error("--profile cannot be used with --batch and --workers greater than 1")
+
+    if args.serve:
+        serve(args.host, args.port)
+        return
+    if args.batch is None and args.function is None:
+        parser.error("the following arguments are required: --function/-f")
+
+    if args.profile:
+        # 使用 --server 时仅能记录客户端的总耗时
+        from herbiv import instrument
+        with instrument.profile() as stats:
+            result = execute(args)
+    else:
+        result = execute(args)
+    if result is not None:
+        if args.prettier:
+            json_prettier(result)
+        else:
+            print(result)
+    if args.profile:
+        print(stats.to_json(), file=sys.stderr)
+
+
+def execute(args) -> str:
+    """
+    执行命令行参数指定的分析或批量请求
+    Args:
+        args: 解析后的命令行参数
+    Returns: 分析结果的 json（批量执行时结果已逐行输出，返回 None）
+    """
+    if args.batch is not None:
+        if args.batch == '-':
+            batch(sys.stdin, args.workers)
+        else:
+            with open(args.batch, encoding='utf-8') as lines:
+                batch(lines, args.workers)
+        return None
+
+    request = {name: getattr(args, name)
+               for name in ("function", "tcms", "formulas", "proteins", "score", "path", "layout", "format")}
+    return request_server(args.server, request) if args.server is not None else run(request)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,22 @@
+"""
+HerbiV：双向可视化的中药数据库及网络药理学分析平台。
+HerbiV: Bidirectional and Visible Database of Herb and network pharmacology analysis platform.
+
+各子模块在首次访问时才导入，``import herbiv`` 不会加载 pandas、pyecharts 等依赖。
+Submodules are imported on first access, so ``import herbiv`` does not load pandas, pyecharts or other dependencies.
+"""
+
+import importlib
+
+__all__ = ['analysis', 'cache', 'compute', 'dataset', 'get', 'graph', 'instrument', 'output']
+
+
+def __getattr__(name):
+    # 首次访问herbiv.<name>时导入相应的子模块
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,16 +1,29 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from herbiv import get
+from herbiv import cache
+from herbiv import graph
+from herbiv import dataset
+from herbiv import instrument
 from herbiv import compute
 from herbiv import output
 
+# permutation_test中每块随机靶点集合的个数，各块的随机数种子由random_state派生
+PERMUTATION_BLOCK_SIZE = 250
+
 
 # TODO: 将文档修改为get中的格式。
+@instrument.staged('analysis.from_tcm_or_formula')
 def from_tcm_or_formula(tcm_or_formula_id,
                         proteins_id=None,
                         score=990,
                         out_for_cytoscape=True,
                         out_graph=True,
                         re=True,
-                        path='results'):
+                        path='results',
+                        top_k=None,
+                        use_cache=False):
     """
         进行经典的正向网络药理学分析
 
@@ -23,6 +36,10 @@ def from_tcm_or_formula(tcm_or_formula_id,
             out_graph (bool): 是否输出基于ECharts的html格式的网络可视化图，默认为True。
             re (bool): 是否返回原始分析结果（中药、化合物（中药成分）、蛋白（靶点）及其连接信息）。
             path (str): 存放结果的目录。
+            top_k (int): 输出的文件和网络图中各层最多保留的节点数（按Importance Score选取，见output.prune），
+                         默认为None（输出全部节点）。
+            use_cache (bool): 是否使用保存在磁盘上的结果缓存（见cache模块），相同的输入、参数和数据集的分析结果将直接
+                              从缓存读取，默认为False。
 
 
         Returns:
@@ -51,8 +68,42 @@ def from_tcm_or_formula(tcm_or_formula_id,
             >>> from_tcm_or_formula(['HVP1625'],['ENSP00000381588', 'ENSP00000252519'], score=400)# medium confidence in STITCH
     """
 
-    
+    inputs = {'ids': sorted(set(tcm_or_formula_id)), 'formula': tcm_or_formula_id[0][2] == 'P',
+              'proteins': None if proteins_id is None else sorted(set(proteins_id)), 'score': score}
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = _cached(
+        use_cache, 'from_tcm_or_formula', inputs, lambda: _forward(tcm_or_formula_id, proteins_id, score))
+
+    if out_for_cytoscape:
+        output.out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path, top_k=top_k)
+
+    if out_graph:
+        output.vis(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path, top_k=top_k)
+
+    if re:
+        if tcm_or_formula_id[0][2] == 'P':
+            return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
+        else:
+            return tcm, tcm_chem_links, chem, chem_protein_links, proteins
+
 
+def _forward(tcm_or_formula_id, proteins_id, score):
+    # 正向网络药理学分析的计算部分，返回各表（输入为HVMID时复方及复方-中药连接信息为None）
+    # 各中药的有效连接及中药×蛋白的向量只与该中药、score和靶点集合有关，可在分析不同的复方时复用
+    cache_key = (score, None if proteins_id is None else frozenset(proteins_id))
+
+    # 筛选有效节点
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = dfs_filter(
+        *_forward_tables(tcm_or_formula_id, proteins_id, score, cache_key))
+
+    tcm, chem, formula = compute.score(tcm, tcm_chem_links, chem, chem_protein_links, formula, formula_tcm_links,
+                                       cache_key=cache_key)
+
+    return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
+
+
+def _forward_tables(tcm_or_formula_id, proteins_id, score, cache_key=None):
+    # 正向网络药理学分析中由get获取的各表（未筛选有效节点）；给出cache_key时，中药-化合物连接、化合物及
+    # 化合物-蛋白连接只包含各中药的有效连接（见_herb_links），筛选有效节点后与不给出时相同
     if tcm_or_formula_id[0][2] == 'P':  # 判断输入是否为复方的HVPID
         formula = get.get_formula('HVPID', tcm_or_formula_id)  # 获取该复方的信息
         formula_tcm_links = get.get_formula_tcm_links('HVPID', formula['HVPID'])
@@ -62,34 +113,75 @@ def from_tcm_or_formula(tcm_or_formula_id,
         formula_tcm_links = None
         tcm = get.get_tcm('HVMID', tcm_or_formula_id)
 
-    tcm_chem_links = get.get_tcm_chem_links('HVMID', tcm['HVMID'])
-    chem = get.get_chemicals('HVCID', tcm_chem_links['HVCID'])
-    chem_protein_links = get.get_chem_protein_links('HVCID', chem['HVCID'], score)
+    if cache_key is None:
+        tcm_chem_links = get.get_tcm_chem_links('HVMID', tcm['HVMID'])
+        chem = get.get_chemicals('HVCID', tcm_chem_links['HVCID'])
+        chem_protein_links = get.get_chem_protein_links('HVCID', chem['HVCID'], score)
+    else:
+        tcm_chem_links, chem, chem_protein_links = _herb_links(tcm['HVMID'], proteins_id, score, cache_key)
 
     if proteins_id is None:
         proteins = get.get_proteins('Ensembl_ID', chem_protein_links['Ensembl_ID'])
     else:
         proteins = get.get_proteins('Ensembl_ID', proteins_id)
 
-    # 深度优先搜索筛选有效节点
-    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = dfs_filter(
-        formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins)
-
-    tcm, chem, formula = compute.score(tcm, tcm_chem_links, chem, chem_protein_links, formula, formula_tcm_links)
-
-    if out_for_cytoscape:
-        output.out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path)
-
-    if out_graph:
-        output.vis(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path)
-
-    if re:
-        if tcm_or_formula_id[0][2] == 'P':
-            return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
-        else:
-            return tcm, tcm_chem_links, chem, chem_protein_links, proteins
+    return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
 
 
+def _herb_links(tcm_id, proteins_id, score, cache_key):
+    # 各中药的有效连接（经dfs_filter筛选后保留的中药-化合物连接在数据集中的行号，及其中化合物的编码）缓存在
+    # compute.tcm_score_cache()中该中药的条目里，已缓存的中药不再查询其全部连接；
+    # 返回只含这些连接的中药-化合物连接、化合物及化合物-蛋白连接
+    herbs = _ids(tcm_id)
+    entries = compute._tcm_entries(herbs, cache_key)
+    missing = [k for k, entry in enumerate(entries) if 'links' not in entry]
+    if missing:
+        for k, links in zip(missing, _valid_herb_links(herbs[missing], proteins_id, score)):
+            entries[k]['links'] = links
+
+    empty = np.zeros(0, dtype=np.int64)
+    rows = np.unique(np.concatenate([empty] + [entry['links'][0] for entry in entries]))
+    chem_ids = dataset.decode('HVCID', np.unique(np.concatenate([empty] + [entry['links'][1] for entry in entries])))
+
+    tcm_chem_links = get._links_at('tcm_chem_links', rows)
+    chem = get.get_chemicals('HVCID', chem_ids)
+    chem_protein_links = get.get_chem_protein_links('HVCID', chem_ids, score)
+
+    return tcm_chem_links, chem, chem_protein_links
+
+
+def _valid_herb_links(herbs, proteins_id, score):
+    # 由邻接数组计算各中药的有效连接，耗时仅与这些中药及其化合物的度数有关：
+    # 有效的化合物在化合物数据集中，且与蛋白数据集中（给出proteins_id时还须在其中）的蛋白之间
+    # 有combined_score大于等于score的连接
+    codes = dataset.encode('HVMID', herbs).astype(np.int64)
+    adj = graph.adjacency('HVMID', 'HVCID')
+    known = np.maximum(codes, 0)
+    starts = np.where(codes >= 0, adj['indptr'][known], 0)
+    ends = np.where(codes >= 0, adj['indptr'][known + 1], 0)
+    positions = graph.ranges(starts, ends)
+    owner = np.repeat(np.arange(len(codes)), ends - starts)
+    rows, chems = adj['rows'][positions], adj['indices'][positions].astype(np.int64)
+
+    candidates = np.unique(chems[chems >= 0])
+    candidates = candidates[np.isin(candidates, dataset.codes('chemicals', 'HVCID'))]
+    protein_adj = graph.adjacency('HVCID', 'Ensembl_ID')
+    starts = graph.search(protein_adj, candidates, np.float32(score / 1000))
+    ends = protein_adj['indptr'][candidates + 1]
+    targets = protein_adj['indices'][graph.ranges(starts, ends)]
+    allowed = dataset.codes('proteins', 'Ensembl_ID')
+    if proteins_id is not None:
+        allowed = np.intersect1d(allowed, dataset.encode('Ensembl_ID', list(proteins_id)))
+    hit = np.isin(targets, allowed)
+    valid = candidates[np.unique(np.repeat(np.arange(len(candidates)), ends - starts)[hit])]
+
+    keep = np.isin(chems, valid)
+    bounds = np.cumsum(np.bincount(owner[keep], minlength=len(codes)))[:-1]
+    return [(herb_rows, np.unique(herb_chems))
+            for herb_rows, herb_chems in zip(np.split(rows[keep], bounds), np.split(chems[keep], bounds))]
+
+
+@instrument.staged('analysis.from_proteins')
 def from_proteins(proteins,
                   score=0,
                   random_state=None,
@@ -98,7 +190,10 @@ def from_proteins(proteins,
                   formula_component=True,
                   out_for_cytoscape=True,
                   re=True,
-                  path='result'):
+                  path='result',
+                  workers=None,
+                  top_k=None,
+                  use_cache=False):
     """
         进行逆向网络药理学分析
 
@@ -112,6 +207,11 @@ def from_proteins(proteins,
             out_for_cytoscape (bool): 是否输出用于Cytoscape绘图的文件。
             re (bool): 是否返回原始分析结果。
             path (str): 存放结果的目录。
+            workers (int): 优化时并行求解使用的进程数，默认为None（不使用多进程）。
+            top_k (int): 输出的文件中各层最多保留的节点数（按Importance Score选取，见output.prune），
+                         默认为None（输出全部节点）。
+            use_cache (bool): 是否使用保存在磁盘上的结果缓存（见cache模块），相同的输入、参数和数据集的分析结果将直接
+                              从缓存读取，默认为False。random_state为None且进行优化时结果是随机的，不使用缓存。
 
 
         Returns:
@@ -137,8 +237,41 @@ def from_proteins(proteins,
             See more at : demo.ipynb
 
     """
+    # 优化结果与workers无关，因此workers不作为缓存的键
+    inputs = {'proteins': sorted(set(proteins)), 'score': score, 'random_state': random_state, 'num': num,
+              'tcm_component': tcm_component, 'formula_component': formula_component}
+    use_cache = use_cache and (random_state is not None or not (tcm_component or formula_component))
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas = _cached(
+        use_cache, 'from_proteins', inputs,
+        lambda: _reverse(proteins, score, random_state, num, tcm_component, formula_component, workers))
+
+    if out_for_cytoscape:
+        output.out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path, top_k=top_k)
+
+    if re:
+        return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas
 
 
+def _reverse(proteins, score, random_state, num, tcm_component, formula_component, workers):
+    # 逆向网络药理学分析的计算部分（含优化），返回各表
+    # 筛选有效节点
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = dfs_filter(
+        *_reverse_tables(proteins, score))
+
+    # 计算Score
+    tcm, chem, formula = compute.score(tcm, tcm_chem_links, chem, chem_protein_links, formula, formula_tcm_links)
+
+    # 调用优化模型
+    tcms = compute.component(tcm.loc[tcm['Importance Score'] != 1.0], random_state, num,
+                             workers=workers) if tcm_component else None
+    formulas = compute.component(formula.loc[formula['Importance Score'] != 1.0],
+                                 random_state, num, workers=workers) if formula_component else None
+
+    return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas
+
+
+def _reverse_tables(proteins, score):
+    # 逆向网络药理学分析中由get获取的各表（未筛选有效节点）
     proteins = get.get_proteins('Ensembl_ID', proteins)
     chem_protein_links = get.get_chem_protein_links('Ensembl_ID', proteins['Ensembl_ID'], score)
 
@@ -152,28 +285,547 @@ def from_proteins(proteins,
     formula_tcm_links = get.get_formula_tcm_links('HVMID', tcm['HVMID'])
     formula = get.get_formula('HVPID', formula_tcm_links['HVPID'])
 
-    # 深度优先搜索筛选有效节点
-    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = dfs_filter(
-        formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins)
+    return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
 
-    # 计算Score
-    tcm, chem, formula = compute.score(tcm, tcm_chem_links, chem, chem_protein_links, formula, formula_tcm_links)
 
-    # 调用优化模型
-    tcms = compute.component(tcm.loc[tcm['Importance Score'] != 1.0], random_state, num) if tcm_component else None
-    formulas = compute.component(formula.loc[formula['Importance Score'] != 1.0],
-                                 random_state, num) if formula_component else None
+def _cached(use_cache, function, inputs, compute_results):
+    # use_cache为True时从保存在磁盘上的结果缓存读取结果，缓存不存在时计算并写入缓存
+    if not use_cache:
+        return compute_results()
+    return cache.cached(function, inputs, compute_results)
 
-    if out_for_cytoscape:
-        output.out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, proteins, path)
 
-    if re:
-        return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins, tcms, formulas
+@instrument.staged('analysis.screen')
+def screen(target_sets, score=0, top_k=10, batch_size=512):
+    """
+        对多个靶点集合同时进行逆向网络药理学筛选，返回各集合的Importance Score排名前top_k的复方、中药和化合物。
+        筛选的节点和Importance Score与from_proteins（不进行优化）一致，各集合共用常驻内存的网络及各层之间的连接，
+        靶点合计不超过batch_size个的集合在同一批中一起计算，仅为排名前top_k的节点生成各靶点的HerbiV Score列。
+
+        Args:
+            target_sets: 靶点集合的列表，每个集合为任何可以迭代的组合数据类型，存储靶点（蛋白）在STITCH中的Ensembl_ID。
+            score (int): HerbiV_chemical_protein_links数据集中仅combined_score大于等于score的记录会被使用，默认为0。
+            top_k (int): 各层返回的节点数，默认为10。
+            batch_size (int): 每批计算的靶点数的上限，默认为512。
+
+        Returns:
+            list: 与target_sets一一对应的字典，键为'formula'、'tcm'和'chem'，值为按Importance Score降序排列的
+            前top_k个复方、中药和化合物的信息及其对各靶点的HerbiV Score和Importance Score（每个ID只保留一行）。
+
+        Examples:
+            >>> results = screen([['ENSP00000381588', 'ENSP00000252519'], ['ENSP00000043402']], top_k=5)
+            >>> results[0]['formula'][['HVPID', 'name', 'Importance Score']]
+    """
+
+    network = _screen_network()
+    sets = [np.unique(_known(dataset.encode('Ensembl_ID', list(ids)), network['ok']['Ensembl_ID']))
+            for ids in target_sets]
+
+    # 将靶点集合分批，每批的靶点合计不超过batch_size个（单个集合超过时单独成批）
+    batches, batch, size = [], [], 0
+    for k, codes in enumerate(sets):
+        if batch and size + len(codes) > batch_size:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(k)
+        size += len(codes)
+    if batch:
+        batches.append(batch)
+
+    results = [None] * len(sets)
+    for batch in batches:
+        proteins = np.unique(np.concatenate([sets[k] for k in batch]))
+        layers = _screen_propagate(network, proteins, score)
+        for k in batch:
+            results[k] = _screen_top(network, layers, proteins, sets[k], top_k)
+
+    return results
+
+
+def _screen_network():
+    # 筛选所需的、与靶点无关的数据：各层节点是否在实体数据集中、在实体数据集中出现的次数、相邻两层之间不重复的连接等
+    def build():
+        n = {ns: len(dataset.vocabulary(ns)) for ns in ('HVPID', 'HVMID', 'HVCID', 'Ensembl_ID')}
+        count = {ns: np.bincount(dataset.codes(name, ns), minlength=n[ns])
+                 for name, ns in (('formula', 'HVPID'), ('tcm', 'HVMID'), ('chemicals', 'HVCID'),
+                                  ('proteins', 'Ensembl_ID'))}
+        ok = {ns: count[ns] > 0 for ns in count}
+        # get.get_chemicals和get.get_proteins返回的每个ID只有一行
+        count['HVCID'] = ok['HVCID'].astype(np.int64)
+        count['Ensembl_ID'] = ok['Ensembl_ID'].astype(np.int64)
+
+        def pairs(source, target):
+            # 两端均在实体数据集中的不重复的连接，按source排序
+            links = dataset.links(graph._link_name(source, target))
+            src, dst = links[source].astype(np.int64), links[target].astype(np.int64)
+            valid = (src >= 0) & (dst >= 0)
+            valid[valid] = ok[source][src[valid]] & ok[target][dst[valid]]
+            return np.unique(np.stack([src[valid], dst[valid]], axis=1), axis=0).reshape(-1, 2)
+
+        formula_tcm = pairs('HVPID', 'HVMID')
+        tcm_chem = pairs('HVMID', 'HVCID')
+
+        def upward(pairs, n_lower):
+            # 由下层节点到上层节点的CSR邻接表
+            order = np.argsort(pairs[:, 1], kind='stable')
+            return {'indptr': np.r_[0, np.cumsum(np.bincount(pairs[:, 1], minlength=n_lower))],
+                    'indices': pairs[order, 0]}
+
+        # 从复方出发可到达的中药，及与这些中药相连的化合物
+        good_tcm = np.zeros(n['HVMID'], dtype=bool)
+        good_tcm[formula_tcm[:, 1]] = True
+        good_chem = np.zeros(n['HVCID'], dtype=bool)
+        good_chem[tcm_chem[good_tcm[tcm_chem[:, 0]], 1]] = True
+
+        # 各ID在实体数据集中第一次出现的行
+        first = {}
+        for name, ns in (('formula', 'HVPID'), ('tcm', 'HVMID'), ('chemicals', 'HVCID')):
+            codes = dataset.codes(name, ns)
+            first[ns] = np.full(n[ns], -1, dtype=np.int64)
+            first[ns][codes[::-1]] = np.arange(len(codes))[::-1]
+
+        return {'n': n, 'count': count, 'ok': ok, 'formula_tcm': formula_tcm, 'tcm_chem': tcm_chem,
+                'chem_tcm': upward(tcm_chem, n['HVCID']), 'tcm_formula': upward(formula_tcm, n['HVMID']),
+                'good_tcm': good_tcm, 'good_chem': good_chem, 'first': first}
+
+    return dataset.derive(('screen',), dataset.DATASETS, build)
+
+
+def _known(codes, ok):
+    # 保留在实体数据集中的编码
+    codes = codes[codes >= 0]
+    return codes[ok[codes]]
+
+
+def _screen_propagate(network, proteins, score):
+    # 计算一批靶点的各层靶点×节点的sum(log(1 - s))矩阵及可到达矩阵（仅含能到达这些靶点的节点的连接）；
+    # 每行对应一个靶点，取一个集合的靶点时只需复制连续的行
+    adj = graph.adjacency('Ensembl_ID', 'HVCID')
+    starts = graph.search(adj, proteins, np.float32(score / 1000))
+    ends = adj['indptr'][proteins + 1]
+    edges = graph.ranges(starts, ends)
+    cols = np.repeat(np.arange(len(proteins)), ends - starts)
+    chems = adj['indices'][edges].astype(np.int64)
+    keep = (chems >= 0)
+    keep[keep] = network['ok']['HVCID'][chems[keep]]
+    chems, cols, edges = chems[keep], cols[keep], edges[keep]
+
+    # 靶点×化合物：与get.get_chem_protein_links返回的Combined_score一致（保留3位小数）
+    chem_log = np.zeros((len(proteins), network['n']['HVCID']))
+    with np.errstate(divide='ignore'):
+        np.add.at(chem_log, (cols, chems), np.log1p(-np.round(adj['score'][edges].astype(np.float64), 3)))
+    chem_reach = np.zeros(chem_log.shape, dtype=bool)
+    chem_reach[cols, chems] = True
+
+    # 靶点×中药、靶点×复方：与compute.score一致，下层节点在get返回的表中重复出现时按出现次数计
+    tcm_log, tcm_reach = _screen_layer(network['chem_tcm'], network['n']['HVMID'], chem_log, chem_reach,
+                                       network['count']['HVCID'])
+    formula_log, formula_reach = _screen_layer(network['tcm_formula'], network['n']['HVPID'], tcm_log, tcm_reach,
+                                               network['count']['HVMID'])
+
+    return {'HVCID': (chem_log, chem_reach), 'HVMID': (tcm_log, tcm_reach), 'HVPID': (formula_log, formula_reach)}
+
+
+def _screen_layer(upper, n, lower_log, lower_reach, counts):
+    # 由下层节点的矩阵计算本层节点的矩阵；只展开能到达靶点的(下层节点, 靶点)项，计算量与连接数而非节点数×靶点数成正比
+    rows, nodes = np.nonzero(lower_reach)
+    starts, ends = upper['indptr'][nodes], upper['indptr'][nodes + 1]
+    edges = graph.ranges(starts, ends)
+    width = len(lower_log)
+    flat = np.repeat(rows * n, ends - starts) + upper['indices'][edges]
+    values = np.repeat(lower_log[rows, nodes] * counts[nodes], ends - starts)
+    log = np.bincount(flat, values, minlength=width * n).reshape(width, n)
+    reach = np.bincount(flat, minlength=width * n).reshape(width, n) > 0
+    return log, reach
+
+
+def _screen_top(network, layers, proteins, codes, top_k):
+    # 一个靶点集合的各层排名前top_k的节点
+    cols = np.searchsorted(proteins, codes)
+
+    # 只取该集合的靶点所在的列
+    log = {ns: layers[ns][0][cols] for ns in layers}
+    reach = {ns: layers[ns][1][cols] for ns in layers}
+
+    # 有效节点：在完整的复方-中药-化合物-蛋白通路中的节点；参与计算Importance Score的靶点为有效化合物能到达的靶点
+    valid = {
+        'HVCID': network['ok']['HVCID'] & network['good_chem'] & reach['HVCID'].any(axis=0),
+        'HVMID': network['ok']['HVMID'] & network['good_tcm'] & reach['HVMID'].any(axis=0),
+        'HVPID': network['ok']['HVPID'] & reach['HVPID'].any(axis=0),
+    }
+    used = reach['HVCID'][:, valid['HVCID']].any(axis=1)
+    cols = cols[used]
+    log = {ns: log[ns][used] for ns in log}
+    columns = [protein + ' HerbiV Score' for protein in dataset.decode('Ensembl_ID', proteins[cols])]
+
+    result = {}
+    for key, ns, name in (('formula', 'HVPID', 'formula'), ('tcm', 'HVMID', 'tcm'), ('chem', 'HVCID', 'chemicals')):
+        rows = np.flatnonzero(valid[ns]) if len(cols) else np.zeros(0, dtype=np.int64)
+        importance = -np.expm1(log[ns][:, rows]).mean(axis=0) if len(cols) else np.zeros(0)
+        top = np.argsort(-importance, kind='stable')[:top_k]
+        rows, importance = rows[top], importance[top]
+
+        # 仅为排名前top_k的节点生成各靶点的HerbiV Score列
+        info = dataset.load(name).iloc[network['first'][ns][rows]].reset_index(drop=True)
+        scores = pd.DataFrame(-np.expm1(log[ns][:, rows].T), columns=columns)
+        info = pd.concat([info, scores], axis=1)
+        info['Importance Score'] = importance
+        result[key] = info
+
+    return result
+
+
+@instrument.staged('analysis.permutation_test')
+def permutation_test(proteins, tcm, chem, formula=None, score=0, num=1000, bin_size=100, random_state=None,
+                     workers=None, batch_size=512):
+    """
+        对逆向网络药理学分析的结果进行置换检验：抽取num个与proteins度数匹配的随机靶点集合，以各节点在随机集合下的
+        Importance Score为零分布，计算经验p值和z值。
+        各靶点按其连接的化合物数（与score对应）分箱，随机集合中的每个靶点从其所在的箱中不重复地抽取，以免仅因连接了大量
+        蛋白而排名靠前的中药和复方被判为显著。Importance Score是各靶点的HerbiV Score的平均值，因此各候选靶点对结果表中
+        节点的HerbiV Score只需计算一次（与screen相同的传播），一块随机集合的Importance Score由选择矩阵与该矩阵相乘得到。
+
+        Args:
+            proteins: 逆向分析使用的靶点（蛋白）在STITCH中的Ensembl_ID。
+            tcm: 中药信息及HerbiV Score，格式与from_proteins或compute.score返回的相同。
+            chem: 化合物信息及HerbiV Score。
+            formula: 复方信息及HerbiV Score，默认为None。
+            score (int): 逆向分析使用的score，默认为0。
+            num (int): 随机靶点集合的个数，默认为1000。
+            bin_size (int): 每个度数箱中至少包含的蛋白数，默认为100。
+            random_state (int): 随机数种子，相同的random_state在任意workers下得到相同的结果。
+            workers (int): 并行计算各块随机集合使用的线程数，默认为None（在当前线程中计算）。
+            batch_size (int): 每批传播的候选靶点数的上限，默认为512。
+
+        Returns:
+            tcm: 中药信息，新增'P Value'列（经验p值，(1 + 不小于观测值的随机集合数) / (num + 1)）和'Z Score'列
+            （(观测值 - 零分布的均值) / 零分布的标准差）。
+            chem: 化合物信息，新增的列同上。
+            formula: 复方信息，新增的列同上（formula为None时为None）。
+
+        Examples:
+            >>> targets = ['ENSP00000381588', 'ENSP00000252519']
+            >>> formula, _, tcm, _, chem, _, _, _, _ = from_proteins(targets, tcm_component=False,
+            ...                                                      formula_component=False, out_for_cytoscape=False)
+            >>> tcm, chem, formula = permutation_test(targets, tcm, chem, formula, num=1000, random_state=0)
+            >>> tcm[['HVMID', 'cn_name', 'Importance Score', 'P Value', 'Z Score']]
+    """
+
+    network = _screen_network()
+    degree = _protein_degrees(network, score)
+    targets = np.unique(_known(dataset.encode('Ensembl_ID', list(proteins)), network['ok']['Ensembl_ID']))
+    targets = targets[degree[targets] > 0]
+    if not len(targets):
+        raise ValueError(f"No compound-protein links found based on the set score value (score={score}). "
+                         f"Please try lowering the score to obtain more results.")
+
+    # 各靶点所在的箱中的全部蛋白（候选靶点），随机集合从中抽取与靶点数相同的蛋白
+    bins = _degree_bins(degree, bin_size)
+    labels, counts = np.unique(bins[targets], return_counts=True)
+    pools = [np.flatnonzero(bins == label) for label in labels]
+    offsets = np.r_[0, np.cumsum([len(pool) for pool in pools])]
+    candidates = np.concatenate(pools)
+
+    # 候选靶点×结果表中各节点的HerbiV Score（不在网络中的节点为0）
+    tables = [(table, ns) for table, ns in ((tcm, 'HVMID'), (chem, 'HVCID'), (formula, 'HVPID')) if table is not None]
+    codes = [dataset.encode(ns, table[ns]) for table, ns in tables]
+    scores = np.zeros((len(candidates), sum(len(code) for code in codes)))
+    for start in range(0, len(candidates), batch_size):
+        layers = _screen_propagate(network, candidates[start:start + batch_size], score)
+        scores[start:start + batch_size] = np.hstack(
+            [-np.expm1(layers[ns][0][:, np.maximum(code, 0)]) * (code >= 0) for (_, ns), code in zip(tables, codes)])
+    observed = np.concatenate([table['Importance Score'].to_numpy(dtype=float) for table, _ in tables])
+
+    # 将num个随机集合按固定大小分块，每块由random_state派生出独立的随机数种子，分块方式与线程数无关
+    sizes = [min(PERMUTATION_BLOCK_SIZE, num - start) for start in range(0, num, PERMUTATION_BLOCK_SIZE)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    args = [(scores, observed, offsets, counts, size, seed) for size, seed in zip(sizes, seeds)]
+    if workers is None or workers <= 1:
+        blocks = [_permutation_block(*arg) for arg in args]
+    else:
+        # 矩阵乘法等计算释放GIL，各线程共用候选靶点的HerbiV Score矩阵
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            blocks = list(executor.map(_permutation_block, *zip(*args)))
+    exceed, total, squares = (np.sum(values, axis=0) for values in zip(*blocks))
+
+    p_value = (1 + exceed) / (num + 1)
+    mean = total / num
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.maximum(squares - num * mean ** 2, 0) / (num - 1))
+        z_score = np.where(std > 0, (observed - mean) / std, np.nan)
+
+    results = []
+    start = 0
+    for (table, _), code in zip(tables, codes):
+        end = start + len(code)
+        table = table.copy()
+        table['P Value'] = np.where(code >= 0, p_value[start:end], np.nan)
+        table['Z Score'] = np.where(code >= 0, z_score[start:end], np.nan)
+        results.append(table)
+        start = end
+
+    if formula is None:
+        results.append(None)
+    return tuple(results)
+
+
+def _protein_degrees(network, score):
+    # 各蛋白在实体数据集中的、与可由复方到达的化合物之间combined_score大于等于score的连接数
+    adj = graph.adjacency('Ensembl_ID', 'HVCID')
+    proteins = np.arange(network['n']['Ensembl_ID'])
+    starts = graph.search(adj, proteins, np.float32(score / 1000))
+    ends = adj['indptr'][proteins + 1]
+    chems = adj['indices'][graph.ranges(starts, ends)].astype(np.int64)
+    keep = chems >= 0
+    keep[keep] = network['ok']['HVCID'][chems[keep]] & network['good_chem'][chems[keep]]
+    degree = np.bincount(np.repeat(proteins, ends - starts)[keep], minlength=len(proteins))
+    degree[~network['ok']['Ensembl_ID']] = 0
+    return degree
+
+
+def _degree_bins(degree, bin_size):
+    # 按度数将有连接的蛋白分箱（无连接的蛋白为-1）：度数相同的蛋白在同一箱中，按度数从小到大依次合并，每箱至少有
+    # bin_size个蛋白，度数最大的不足bin_size个的蛋白并入前一箱
+    values, counts = np.unique(degree[degree > 0], return_counts=True)
+    labels = np.zeros(len(values), dtype=np.int64)
+    label, size = 0, 0
+    for i, count in enumerate(counts):
+        labels[i] = label
+        size += count
+        if size >= bin_size:
+            label, size = label + 1, 0
+    if size and label:
+        labels[labels == label] = label - 1
+
+    bins = np.full(len(degree), -1, dtype=np.int64)
+    bins[degree > 0] = labels[np.searchsorted(values, degree[degree > 0])]
+    return bins
+
+
+def _permutation_block(scores, observed, offsets, counts, size, seed):
+    # 一块随机集合：不小于观测值的集合数、Importance Score之和及平方和
+    rng = np.random.default_rng(seed)
+    chosen = np.hstack([_sample(rng, size, offsets[i + 1] - offsets[i], count) + offsets[i]
+                        for i, count in enumerate(counts)])
+
+    # 选择矩阵（随机集合×候选靶点）与候选靶点的HerbiV Score矩阵相乘，得到各随机集合下各节点的Importance Score
+    selection = np.zeros((size, len(scores)))
+    selection[np.arange(size)[:, None], chosen] = 1 / chosen.shape[1]
+    null = selection @ scores
+
+    # 与观测值相等（如随机集合恰为proteins）时计为不小于观测值，容许浮点误差
+    exceed = np.count_nonzero(null >= observed - 1e-12, axis=0)
+    return exceed, null.sum(axis=0), np.square(null).sum(axis=0)
+
+
+def _sample(rng, size, n, k):
+    # size次从range(n)中不重复地抽取k个
+    if k * k <= 2 * n:
+        # k远小于n时重复的概率较小，重新抽取有重复的行
+        draws = rng.integers(0, n, (size, k))
+        while True:
+            repeated = (np.diff(np.sort(draws, axis=1), axis=1) == 0).any(axis=1)
+            if not repeated.any():
+                return draws
+            draws[repeated] = rng.integers(0, n, (np.count_nonzero(repeated), k))
+    return rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)[:, :k]
+
+
+@instrument.staged('analysis.sweep')
+def sweep(thresholds, tcm_or_formula_id=None, proteins_id=None, top_k=10):
+    """
+        在一次计算中评估多个combined_score阈值：正向（给定tcm_or_formula_id）或逆向（仅给定proteins_id）网络药理学分析。
+        各表仅在最低的阈值下获取一次，化合物-蛋白连接按combined_score降序排列一次，按阈值从高到低依次加入新的连接，
+        并只将新连接的sum(log(1 - s))增量传播到中药和复方，总耗时与在最低的阈值下运行一次相当。
+        各阈值的节点和HerbiV Score与在该阈值下运行get、dfs_filter和compute.score（不进行优化）一致。
 
+        Args:
+            thresholds: 阈值的列表，与from_tcm_or_formula和from_proteins的score含义相同。
+            tcm_or_formula_id: 任何可以使用in判断一个元素是否在其中的组合数据类型，存储拟分析的中药或复方的ID，
+            如HVM0367或HVP1625，不为None时进行正向分析。默认为None。
+            proteins_id: 存储靶点（蛋白）在STITCH中的Ensembl_ID。正向分析时仅分析这些靶点（为None时分析全部靶点），
+            逆向分析时为拟分析的靶点。默认为None。
+            top_k (int): 各层返回的节点数，为None时返回全部有效节点。默认为10。
+
+        Returns:
+            dict: 键为thresholds中的各阈值，值为字典：'counts' - 各表（与dfs_filter的返回值同名）经筛选后的行数
+            （输入为HVMID时复方及复方-中药连接为None）；'formula'、'tcm'和'chem' - 按Importance Score降序排列的
+            前top_k个复方、中药和化合物的信息及其对各靶点的HerbiV Score和Importance Score（每个ID只保留一行）。
+
+        Examples:
+            >>> results = sweep([400, 700, 900, 990], ['HVP1625'])
+            >>> {threshold: result['counts']['tcm'] for threshold, result in results.items()}
+            >>> results[700]['tcm'][['HVMID', 'cn_name', 'Importance Score']]
+    """
 
+    thresholds = list(thresholds)
+    if not thresholds:
+        raise ValueError('thresholds cannot be empty.')
+
+    # 在最低的阈值下获取各表，更高阈值下的各表均为其子集
+    lowest = min(thresholds)
+    if tcm_or_formula_id is not None:
+        tables = _forward_tables(tcm_or_formula_id, proteins_id, lowest)
+    elif proteins_id is not None:
+        tables = _reverse_tables(proteins_id, lowest)
+    else:
+        raise ValueError('tcm_or_formula_id and proteins_id cannot both be None.')
+
+    network = _sweep_network(*tables)
+    results = {}
+    for threshold in sorted(set(thresholds), reverse=True):
+        _sweep_add(network, threshold)
+        results[threshold] = _sweep_result(network, tables, top_k)
+
+    return {threshold: results[threshold] for threshold in thresholds}
+
+
+def _sweep_network(formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins):
+    # 以各表中节点的位置编号的网络：各节点在表中出现的次数、相邻两层之间不重复的连接、按分数降序排列的化合物-蛋白连接，
+    # 及各层当前（已加入的连接）的sum(log(1 - s))矩阵
+    layers = [('HVMID', tcm), ('HVCID', chem), ('Ensembl_ID', proteins)]
+    if formula is not None:
+        layers.append(('HVPID', formula))
+    ids = {ns: pd.Index(_ids(table[ns])) for ns, table in layers}
+    n = {ns: len(ids[ns]) for ns in ids}
+    codes = {ns: ids[ns].get_indexer(table[ns]) for ns, table in layers}
+    count = {ns: np.bincount(codes[ns][codes[ns] >= 0], minlength=n[ns]) for ns in ids}
+    # 各ID在表中第一次出现的行
+    first = {}
+    for ns in ids:
+        first[ns] = np.full(n[ns], -1, dtype=np.int64)
+        first[ns][codes[ns][::-1]] = np.arange(len(codes[ns]))[::-1]
+
+    def rows(links, source, target):
+        # 两端均在表中的连接（保留重复的连接，用于统计行数）
+        src, dst = ids[source].get_indexer(links[source]), ids[target].get_indexer(links[target])
+        valid = (src >= 0) & (dst >= 0)
+        return src[valid], dst[valid]
+
+    def upward(src, dst, n_lower):
+        # 不重复的连接及由下层节点到上层节点的CSR邻接表
+        pairs = np.unique(np.stack([src, dst], axis=1), axis=0).reshape(-1, 2)
+        order = np.argsort(pairs[:, 1], kind='stable')
+        return pairs, {'indptr': np.r_[0, np.cumsum(np.bincount(pairs[:, 1], minlength=n_lower))],
+                       'indices': pairs[order, 0]}
+
+    network = {'n': n, 'ids': ids, 'count': count, 'first': first}
+    network['tcm_chem_rows'] = rows(tcm_chem_links, 'HVMID', 'HVCID')
+    network['tcm_chem'], network['chem_tcm'] = upward(*network['tcm_chem_rows'], n['HVCID'])
+    if formula is not None:
+        network['formula_tcm_rows'] = rows(formula_tcm_links, 'HVPID', 'HVMID')
+        network['formula_tcm'], network['tcm_formula'] = upward(*network['formula_tcm_rows'], n['HVMID'])
+
+    # 化合物-蛋白连接按分数降序排列（分数相同时保持在表中的顺序），与get.get_chem_protein_links一致，阈值按整数比较
+    c = ids['HVCID'].get_indexer(chem_protein_links['HVCID'])
+    p = ids['Ensembl_ID'].get_indexer(chem_protein_links['Ensembl_ID'])
+    scores = chem_protein_links['Combined_score'].to_numpy(dtype=float)
+    keep = np.flatnonzero((c >= 0) & (p >= 0))
+    order = keep[np.argsort(-np.rint(scores[keep] * 1000), kind='stable')]
+    with np.errstate(divide='ignore'):
+        network['edges'] = {'chem': c[order], 'protein': p[order], 'row': order,
+                            'score': np.rint(scores[order] * 1000), 'log': np.log1p(-scores[order])}
+    network['added'] = 0
+
+    network['log'] = {ns: np.zeros((n[ns], n['Ensembl_ID'])) for ns in ('HVCID', 'HVMID', 'HVPID') if ns in n}
+    network['chem_reach'] = np.zeros(n['HVCID'], dtype=bool)
+    return network
+
+
+def _sweep_add(network, threshold):
+    # 加入分数大于等于threshold的新连接，并将其sum(log(1 - s))增量逐层传播到中药和复方（传播是线性的）
+    edges = network['edges']
+    end = int(np.searchsorted(-edges['score'], -threshold, side='right'))
+    start, network['added'] = network['added'], max(end, network['added'])
+    if end <= start:
+        return
+
+    chems, cols, values = edges['chem'][start:end], edges['protein'][start:end], edges['log'][start:end]
+    np.add.at(network['log']['HVCID'], (chems, cols), values)
+    network['chem_reach'][chems] = True
+
+    # 与compute.score一致，下层节点在表中重复出现时按出现次数计
+    for lower, upper, name in (('HVCID', 'HVMID', 'chem_tcm'), ('HVMID', 'HVPID', 'tcm_formula')):
+        if name not in network:
+            break
+        adj = network[name]
+        starts, ends = adj['indptr'][chems], adj['indptr'][chems + 1]
+        repeat = ends - starts
+        values = np.repeat(values * network['count'][lower][chems], repeat)
+        chems, cols = adj['indices'][graph.ranges(starts, ends)], np.repeat(cols, repeat)
+        np.add.at(network['log'][upper], (chems, cols), values)
+
+
+def _sweep_result(network, tables, top_k):
+    # 当前阈值下的有效节点（与dfs_filter一致）、各表的行数及各层排名前top_k的节点
+    n, edges, added = network['n'], network['edges'], network['added']
+    chem_reach = network['chem_reach']
+
+    # 反向半连接：能到达蛋白的中药
+    tcm_chem = network['tcm_chem']
+    tcm_valid = np.zeros(n['HVMID'], dtype=bool)
+    tcm_valid[tcm_chem[chem_reach[tcm_chem[:, 1]], 0]] = True
+
+    # 正向半连接：从复方（或中药）出发可到达、且能到达蛋白的节点
+    formula_valid = None
+    if 'formula_tcm' in network:
+        formula_tcm = network['formula_tcm']
+        reached = formula_tcm[tcm_valid[formula_tcm[:, 1]]]
+        formula_valid = np.zeros(n['HVPID'], dtype=bool)
+        formula_valid[reached[:, 0]] = True
+        tcm_valid = np.zeros(n['HVMID'], dtype=bool)
+        tcm_valid[reached[:, 1]] = True
+    chem_valid = np.zeros(n['HVCID'], dtype=bool)
+    chem_valid[tcm_chem[tcm_valid[tcm_chem[:, 0]] & chem_reach[tcm_chem[:, 1]], 1]] = True
+    active = chem_valid[edges['chem'][:added]]
+    protein_valid = np.zeros(n['Ensembl_ID'], dtype=bool)
+    protein_valid[edges['protein'][:added][active]] = True
+
+    valid = {'HVPID': formula_valid, 'HVMID': tcm_valid, 'HVCID': chem_valid, 'Ensembl_ID': protein_valid}
+    count = network['count']
+
+    def links(name, source, target):
+        src, dst = network[name]
+        return int(np.count_nonzero(valid[source][src] & valid[target][dst]))
+
+    counts = {
+        'formula': None if formula_valid is None else int(count['HVPID'][formula_valid].sum()),
+        'formula_tcm_links': None if formula_valid is None else links('formula_tcm_rows', 'HVPID', 'HVMID'),
+        'tcm': int(count['HVMID'][tcm_valid].sum()),
+        'tcm_chem_links': links('tcm_chem_rows', 'HVMID', 'HVCID'),
+        'chem': int(count['HVCID'][chem_valid].sum()),
+        'chem_protein_links': int(np.count_nonzero(active)),
+        'proteins': int(count['Ensembl_ID'][protein_valid].sum()),
+    }
+
+    # 各靶点的HerbiV Score列按筛选后的化合物-蛋白连接中靶点出现的顺序排列，与compute.score一致
+    order = np.argsort(edges['row'][:added][active], kind='stable')
+    cols = pd.unique(edges['protein'][:added][active][order])
+    columns = list(network['ids']['Ensembl_ID'].to_numpy(dtype=object)[cols] + ' HerbiV Score')
+
+    formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins = tables
+    result = {'counts': counts, 'formula': None}
+    for key, ns, table in (('formula', 'HVPID', formula), ('tcm', 'HVMID', tcm), ('chem', 'HVCID', chem)):
+        if valid[ns] is None:
+            continue
+        rows = np.flatnonzero(valid[ns])
+        scores = -np.expm1(network['log'][ns][np.ix_(rows, cols)])
+        importance = scores.mean(axis=1) if len(cols) else np.zeros(len(rows))
+        top = np.argsort(-importance, kind='stable')[:top_k]
+
+        info = table.iloc[network['first'][ns][rows[top]]].reset_index(drop=True)
+        info = pd.concat([info, pd.DataFrame(scores[top], columns=columns)], axis=1)
+        info['Importance Score'] = importance[top]
+        result[key] = info
+
+    return result
+
+
+@instrument.staged('analysis.dfs_filter')
 def dfs_filter(formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins):
     """
-        深度优先搜索筛选有效节点（在完整的（复方-）中药-化合物-蛋白通路中的节点）
+        筛选有效节点（在完整的（复方-）中药-化合物-蛋白通路中的节点）。
+        有效节点由沿网络的反向和正向半连接得到，耗时与各表的行数成线性关系。
 
         Args:
             formula: 复方信息。
@@ -205,22 +857,27 @@ def dfs_filter(formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_prote
     """
 
 
-    formula_id = set()
-    tcm_id = set()
-    chem_id = set()
-    proteins_id = set()
+    # 反向半连接：能到达proteins中的蛋白的化合物和中药
+    proteins_id = _ids(proteins['Ensembl_ID'])
+    reaching = chem_protein_links.loc[chem_protein_links['Ensembl_ID'].isin(proteins_id)]
+    chem_id = _ids(reaching['HVCID'])
+    reaching = tcm_chem_links.loc[tcm_chem_links['HVCID'].isin(chem_id)]
+    tcm_id = _ids(reaching['HVMID'])
 
-    # 深度优先搜索得到有效节点的ID
-    for f in formula['HVPID'] if (formula_tcm_links is not None) else [0]:
-        for m in tcm['HVMID'] if (formula_tcm_links is None) else set(formula_tcm_links.loc[
-                                                                        formula_tcm_links['HVPID'] == f]['HVMID']):
-            for c in set(tcm_chem_links.loc[tcm_chem_links['HVMID'] == m]['HVCID']):
-                for p in set(chem_protein_links.loc[chem_protein_links['HVCID'] == c]['Ensembl_ID']):
-                    if p in proteins['Ensembl_ID'].tolist():
-                        formula_id.add(f)
-                        tcm_id.add(m)
-                        chem_id.add(c)
-                        proteins_id.add(p)
+    # 正向半连接：从复方（或中药）出发可到达、且能到达蛋白的节点，即在完整通路中的节点
+    if formula_tcm_links is None:
+        formula_id = None
+        tcm_id = tcm_id[tcm_id.isin(_ids(tcm['HVMID']))]
+    else:
+        reached = formula_tcm_links.loc[formula_tcm_links['HVPID'].isin(_ids(formula['HVPID'])) &
+                                        formula_tcm_links['HVMID'].isin(tcm_id)]
+        formula_id = _ids(reached['HVPID'])
+        tcm_id = _ids(reached['HVMID'])
+    reached = tcm_chem_links.loc[tcm_chem_links['HVMID'].isin(tcm_id) & tcm_chem_links['HVCID'].isin(chem_id)]
+    chem_id = _ids(reached['HVCID'])
+    reached = chem_protein_links.loc[chem_protein_links['HVCID'].isin(chem_id) &
+                                     chem_protein_links['Ensembl_ID'].isin(proteins_id)]
+    proteins_id = _ids(reached['Ensembl_ID'])
 
     # 根据有效节点的ID更新formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
     formula = None if formula is None else formula.loc[formula['HVPID'].isin(formula_id)]
@@ -241,6 +898,11 @@ def dfs_filter(formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_prote
     return formula, formula_tcm_links, tcm, tcm_chem_links, chem, chem_protein_links, proteins
 
 
+def _ids(column):
+    # 列中不重复的非空ID
+    return pd.Series(column.dropna().unique())
+
+
 if __name__ == '__main__':
     from_tcm_or_formula(['HVP1625'], ['ENSP00000381588', 'ENSP00000252519'], score=100000)
     tcm_ft, tcm_chem_links_ft, chem_ft, chem_protein_links_ft, protein_ft = from_tcm_or_formula(['HVM0735'], )
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+from herbiv import dataset
+from herbiv import instrument
+
+# 缓存所在目录，可通过环境变量HERBIV_CACHE_DIR指定
+CACHE_DIR = os.environ.get('HERBIV_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'herbiv'))
+
+# 缓存占用的磁盘空间（字节）和条目保存时间（秒）的默认上限
+MAX_SIZE = 1 << 30
+MAX_AGE = 30 * 24 * 3600
+
+# 缓存格式的版本号，格式变化时递增
+CACHE_VERSION = 1
+
+_directory = CACHE_DIR
+_max_size = MAX_SIZE
+_max_age = MAX_AGE
+
+_lock = threading.RLock()
+
+
+def configure(directory=None, max_size=MAX_SIZE, max_age=MAX_AGE):
+    """
+        设置缓存所在的目录及其占用的磁盘空间和条目保存时间的上限。
+        Set the cache directory, its disk space limit and the maximum age of its entries.
+
+        Args:
+            directory (str): 缓存所在目录，默认为CACHE_DIR。Cache directory, CACHE_DIR by default.
+            max_size (int): 缓存占用的磁盘空间上限（字节），为None时不限制。超出上限时按最近最少使用的顺序删除条目。
+            Disk space limit in bytes, unlimited if None. Least recently used entries are removed beyond it.
+            max_age (float): 条目的保存时间上限（秒），为None时不限制。Maximum age of entries in seconds, unlimited if None.
+
+        Examples:
+            >>> configure('/tmp/herbiv-cache', max_size=256 * 1024 ** 2, max_age=7 * 24 * 3600)
+    """
+
+    global _directory, _max_size, _max_age
+    with _lock:
+        _directory = CACHE_DIR if directory is None else directory
+        _max_size = max_size
+        _max_age = max_age
+        evict()
+
+
+def key(function, inputs) -> str:
+    """
+        计算缓存条目的键：函数名称、规范化的输入和参数及数据集校验和的SHA-256。
+        Compute the key of a cache entry: SHA-256 of the function name, the normalized inputs and parameters,
+        and the dataset checksum.
+
+        Args:
+            function (str): 函数的名称。Name of the function.
+            inputs (dict): 规范化的输入和参数，须可以转换为json。Normalized inputs and parameters, JSON serializable.
+
+        Returns:
+            str: 缓存条目的键。Key of the cache entry.
+    """
+
+    text = json.dumps({'function': function, 'inputs': inputs, 'datasets': dataset.checksum(),
+                       'version': CACHE_VERSION}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@instrument.staged('cache.get')
+def get(entry_key):
+    """
+        读取缓存的结果，不存在或已过期时返回None。
+        Read cached results, None if the entry does not exist or has expired.
+
+        Args:
+            entry_key (str): 缓存条目的键。Key of the cache entry.
+
+        Returns:
+            list: 缓存的结果（DataFrame或None的列表）。Cached results (list of DataFrames or None).
+    """
+
+    path = os.path.join(_directory, entry_key)
+    info = _entry_info(path)
+    if info is None:
+        return None
+
+    if _max_age is not None and time.time() - info['created'] > _max_age:
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    try:
+        results = [None if table is None else _read_table(table, os.path.join(path, str(i)))
+                   for i, table in enumerate(info['tables'])]
+    except (OSError, ValueError, KeyError):
+        # 条目不完整（如正在被删除）时视为不存在
+        return None
+
+    # 记录最近使用的时间
+    os.utime(os.path.join(path, 'entry.json'))
+    return results
+
+
+@instrument.staged('cache.put')
+def put(entry_key, function, results):
+    """
+        将结果写入缓存，并按占用的磁盘空间和保存时间的上限删除条目。
+        Write results into the cache, then remove entries beyond the disk space and age limits.
+
+        Args:
+            entry_key (str): 缓存条目的键。Key of the cache entry.
+            function (str): 函数的名称，用于invalidate。Name of the function, used by invalidate.
+            results (collections.abc.Iterable): 要缓存的结果（DataFrame或None）。Results to cache (DataFrames or None).
+    """
+
+    os.makedirs(_directory, exist_ok=True)
+
+    # 先写入临时目录再重命名，写入中断或多个进程同时写入时不会读取到不完整的条目
+    temp = tempfile.mkdtemp(prefix='.tmp-', dir=_directory)
+    try:
+        tables = []
+        for i, table in enumerate(results):
+            if table is None:
+                tables.append(None)
+                continue
+            table_dir = os.path.join(temp, str(i))
+            os.makedirs(table_dir)
+            tables.append(_write_table(table, table_dir))
+
+        info = {'version': CACHE_VERSION, 'function': function, 'created': time.time(), 'tables': tables}
+        with open(os.path.join(temp, 'entry.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+
+        path = os.path.join(_directory, entry_key)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # 其他进程已写入相同的条目
+            shutil.rmtree(temp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(temp, ignore_errors=True)
+        raise
+
+    evict()
+
+
+def cached(function, inputs, compute):
+    """
+        缓存存在时读取缓存的结果，否则调用compute计算结果并写入缓存。
+        Return the cached results if present, otherwise call compute and cache its results.
+
+        Args:
+            function (str): 函数的名称。Name of the function.
+            inputs (dict): 规范化的输入和参数，须可以转换为json。Normalized inputs and parameters, JSON serializable.
+            compute (collections.abc.Callable): 计算结果的无参函数，返回DataFrame或None的元组。
+            Function without arguments that computes the results, returning a tuple of DataFrames or None.
+
+        Returns:
+            tuple: 结果。The results.
+
+        Examples:
+            >>> cached('from_proteins', {'proteins': ['ENSP00000381588'], 'score': 0}, lambda: (tcm, chem))
+    """
+
+    entry_key = key(function, inputs)
+    results = get(entry_key)
+    if results is None:
+        results = compute()
+        put(entry_key, function, results)
+    return tuple(results)
+
+
+def invalidate(function=None) -> int:
+    """
+        删除缓存的条目（如数据集被更新后）。
+        Remove cache entries (e.g. after the datasets are updated).
+
+        Args:
+            function (str): 仅删除该函数的条目，为None时删除全部条目。
+            Only remove the entries of this function, all entries if None.
+
+        Returns:
+            int: 删除的条目数。Number of removed entries.
+
+        Examples:
+            >>> invalidate('from_proteins')
+            3
+    """
+
+    removed = 0
+    with _lock:
+        for path, info, _, _ in _entries():
+            if function is None or info is None or info.get('function') == function:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
+
+
+def evict():
+    """
+        删除已过期的条目，然后按最近最少使用的顺序删除条目，直至占用的磁盘空间不超过上限。
+        Remove expired entries, then remove least recently used entries until the disk space limit is met.
+    """
+
+    with _lock:
+        now = time.time()
+        entries = []
+        for path, info, used, size in _entries():
+            if info is None or (_max_age is not None and now - info['created'] > _max_age):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                entries.append((used, size, path))
+
+        if _max_size is None:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            if total <= _max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def size() -> int:
+    """
+        获取缓存占用的磁盘空间（字节）。
+        Get the disk space used by the cache in bytes.
+    """
+
+    return sum(entry[3] for entry in _entries())
+
+
+def _entries():
+    # 缓存中的各条目：路径、entry.json的内容（无法读取时为None）、最近使用的时间及占用的磁盘空间
+    if not os.path.isdir(_directory):
+        return []
+
+    entries = []
+    for name in os.listdir(_directory):
+        path = os.path.join(_directory, name)
+        if name.startswith('.') or not os.path.isdir(path):
+            continue
+        info = _entry_info(path)
+        try:
+            used = os.path.getmtime(os.path.join(path, 'entry.json')) if info is not None else 0
+            total = sum(os.path.getsize(os.path.join(root, file))
+                        for root, _, files in os.walk(path) for file in files)
+        except OSError:
+            continue
+        entries.append((path, info, used, total))
+    return entries
+
+
+def _entry_info(path):
+    try:
+        with open(os.path.join(path, 'entry.json'), encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return info if info.get('version') == CACHE_VERSION else None
+
+
+def _write_table(table, table_dir):
+    # 按列存储DataFrame：同一类型的数值列合并为一个按列存储的二维数组，其余各列按dataset快照的格式按字典编码存储
+    info = {'rows': int(table.shape[0]), 'columns': [], 'blocks': {}, 'index': None}
+    groups = {}
+    for i, (name, column) in enumerate(table.items()):
+        if column.dtype.kind in 'biufc':
+            dtype = str(column.dtype)
+            block = groups.setdefault(dtype, [])
+            info['columns'].append({'name': name, 'block': dtype, 'position': len(block)})
+            block.append(i)
+        else:
+            col = dataset._write_column(column.rename(name), table_dir, str(i))
+            info['columns'].append({'name': name, 'column': col})
+
+    for dtype, positions in groups.items():
+        file = f'block.{dtype}.npy'
+        np.save(os.path.join(table_dir, file), np.asfortranarray(table.iloc[:, positions].to_numpy(dtype=dtype)),
+                allow_pickle=False)
+        info['blocks'][dtype] = file
+
+    # 默认的索引（0, 1, 2...）不保存
+    if not table.index.equals(pd.RangeIndex(table.shape[0])) or table.index.name is not None:
+        info['index'] = dataset._write_column(pd.Series(table.index, name=table.index.name), table_dir, 'index')
+
+    return info
+
+
+def _read_table(info, table_dir):
+    blocks = {dtype: np.load(os.path.join(table_dir, file), allow_pickle=False)
+              for dtype, file in info['blocks'].items()}
+
+    # 各数值块整体转换为DataFrame（不逐列创建Series），再按原来的顺序排列各列
+    positions = {dtype: [] for dtype in blocks}
+    strings = {}
+    for i, col in enumerate(info['columns']):
+        if 'block' in col:
+            positions[col['block']].append(i)
+        else:
+            strings[i] = dataset._read_column(col['column'], table_dir).copy()
+
+    pieces = [pd.DataFrame(blocks[dtype], columns=positions[dtype], copy=False) for dtype in blocks]
+    if strings:
+        pieces.append(pd.DataFrame(strings))
+    table = pd.concat(pieces, axis=1) if pieces else pd.DataFrame(index=pd.RangeIndex(info['rows']))
+    table = table.reindex(columns=range(len(info['columns'])))
+    table.columns = [col['name'] for col in info['columns']]
+
+    if info['index'] is not None:
+        index = dataset._read_column(info['index'], table_dir).copy()
+        table.index = pd.Index(index, name=info['index']['name'])
+
+    return table
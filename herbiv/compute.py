@@ -1,18 +1,32 @@
+import threading
 import numpy as np
 import pandas as pd
 from typing import Union
 from math import ceil
-import random
-from tqdm import tqdm
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from herbiv import dataset
+from herbiv import instrument
 
+# component中每块抽样的次数，各块的随机数种子由random_state派生
+COMPONENT_BLOCK_SIZE = 50
 
+# 各中药的缓存条目（有效连接及中药×蛋白的sum(log(1 - s))向量）的条目数上限
+TCM_SCORE_CACHE_SIZE = 4096
+
+# 各中药的缓存条目所依赖的数据集
+TCM_SCORE_DATASETS = ('tcm_chem_links', 'chemicals', 'chem_protein_links', 'proteins')
+
+
+@instrument.staged('compute.score')
 def score(tcm: pd.DataFrame,
           tcm_chem_links: pd.DataFrame,
           chem: pd.DataFrame,
           chem_protein_links: pd.DataFrame,
           formula: Union[pd.DataFrame, None] = None,
           formula_tcm_links: Union[pd.DataFrame, None] = None,
-          weights: Union[dict, None] = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+          weights: Union[dict, None] = None,
+          cache_key: Union[tuple, None] = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
         计算复方、中药和化合物的HerbiV Score。
 
@@ -23,7 +37,14 @@ def score(tcm: pd.DataFrame,
             chem_protein_links: chem和拟分析靶点（蛋白）的化合物（中药成分）-蛋白质（靶点）连接信息。
             formula: 要计算HerbiV Score的复方信息，格式与get.get_formulas的返回值相同。默认为None。
             formula_tcm_links: formula和tcm中的复方-中药连接信息。默认为None。
-            weights: 各靶点（蛋白）的权重，各权重的和应为1。默认为None，计算时将自动替换为相等的值。
+            weights: 各靶点（蛋白）的权重，键为Ensembl_ID或'<Ensembl_ID> HerbiV Score'，未给出的靶点权重为0。权重须为
+                     非负数，计算时归一化为和为1（因此和为1或为靶点总数均可），Importance Score为各靶点HerbiV Score的
+                     加权和。默认为None（各靶点权重相等，即HerbiV Score的平均值）。多组权重见score_scenarios。
+            cache_key: 筛选chem_protein_links时使用的(score, 靶点集合)，靶点集合为frozenset或None（不限制靶点）。
+                       默认为None（不使用缓存）。不为None时，tcm_chem_links和chem_protein_links应包含各中药的全部
+                       有效连接（如analysis.from_tcm_or_formula中经dfs_filter筛选后的连接），各中药×蛋白的向量
+                       缓存在以(HVMID, score, 靶点集合, 数据集版本)为键的条目中（见_tcm_entries），已缓存的中药
+                       不再由化合物层计算。
 
         Returns:
             包含HerbiV Score的复方、中药和成分（化合物）的信息。
@@ -96,44 +117,48 @@ def score(tcm: pd.DataFrame,
     tcm_and_score = tcm.copy()
     chem_and_score = chem.copy()
 
-    proteins_id = chem_protein_links['Ensembl_ID'].unique()
-
-    # 计算与各蛋白对应的HerbiV Score
-    for protein in proteins_id:
-
-        # 计算每一个化合物的HerbiV Score
-        chem_and_score[protein + ' HerbiV Score'] = chem.loc[:, 'HVCID'].apply(lambda x: 1 - (1 - np.array(
-            [*chem_protein_links.loc[(chem_protein_links['HVCID'] == x) &
-                                     (chem_protein_links['Ensembl_ID'] == protein)]['Combined_score']])
-                                                                                              ).prod()
-                                                                               )
-
-        # 计算各中药的HerbiV Score
-        tcm_and_score[protein + ' HerbiV Score'] = tcm.loc[:, 'HVMID'].apply(lambda x: 1 - (1 - np.array(
-            [*chem_and_score.loc[chem_and_score['HVCID'].isin(
-                tcm_chem_links.loc[tcm_chem_links['HVMID'] == x]['HVCID'])][protein + ' HerbiV Score']])
-                                                                                            ).prod()
-                                                                             )
-
-        # 若传入了复方相关信息，则还需计算各复方的HerbiV Score
-        if formula is not None:
-            formula_and_score[protein + ' HerbiV Score'] = formula.loc[:, 'HVPID'].apply(lambda x: 1 - (1 - np.array(
-                [*tcm_and_score.loc[tcm_and_score['HVMID'].isin(
-                    formula_tcm_links.loc[formula_tcm_links['HVPID'] == x]['HVMID'])][protein + ' HerbiV Score']])
-                                                                                                        ).prod()
-                                                                                         )
-
-    # TODO: 验证各权重的和是否为靶点（蛋白）的总数或和为1。若权重为小数，则需要据此计算权重。
-    # 若使用默认权重，则权重默认均为1
-    if weights is None:
-        weights = {col: 1 for col in [protein + ' HerbiV Score' for protein in proteins_id]}
+    proteins_id = np.asarray(chem_protein_links['Ensembl_ID'].unique(), dtype=object)
+    columns = list(proteins_id + ' HerbiV Score')
+
+    # 在对数空间中计算HerbiV Score：1 - prod(1 - s) = 1 - exp(sum(log(1 - s)))，
+    # 各层的sum(log(1 - s))矩阵（节点×蛋白）由下一层的矩阵与两层之间的关联矩阵相乘得到
+
+    # 化合物×蛋白：各化合物与各蛋白所有连接的log(1 - s)之和
+    chem_ids = pd.Index(chem['HVCID'].unique())
+    chem_log = np.zeros((len(chem_ids), len(proteins_id)))
+    c = chem_ids.get_indexer(chem_protein_links['HVCID'])
+    p = pd.Index(proteins_id).get_indexer(chem_protein_links['Ensembl_ID'])
+    with np.errstate(divide='ignore'):
+        np.add.at(chem_log, (c[c >= 0], p[c >= 0]),
+                  np.log1p(-chem_protein_links['Combined_score'].to_numpy(dtype=float)[c >= 0]))
+
+    # 中药×蛋白、复方×蛋白
+    if cache_key is None:
+        tcm_ids, tcm_log = _propagate(tcm['HVMID'], tcm_chem_links['HVMID'], tcm_chem_links['HVCID'],
+                                      chem['HVCID'], chem_ids, chem_log)
+    else:
+        tcm_ids, tcm_log = _cached_tcm_log(tcm['HVMID'], tcm_chem_links, chem, chem_ids, chem_log,
+                                           pd.Index(proteins_id), cache_key)
+    if formula is not None:
+        formula_ids, formula_log = _propagate(formula['HVPID'], formula_tcm_links['HVPID'],
+                                              formula_tcm_links['HVMID'], tcm['HVMID'], tcm_ids, tcm_log)
+        formula_and_score = _add_scores(formula_and_score, formula_ids.get_indexer(formula['HVPID']),
+                                        formula_log, columns)
+    tcm_and_score = _add_scores(tcm_and_score, tcm_ids.get_indexer(tcm['HVMID']), tcm_log, columns)
+    chem_and_score = _add_scores(chem_and_score, chem_ids.get_indexer(chem['HVCID']), chem_log, columns)
 
     # TODO: 将所有Importance Score替换为HerbiV Score
-    # 加权计算各复方、中药、成分（化合物）的HerbiV Score
-    if formula is not None:
-        formula_and_score['Importance Score'] = (formula_and_score[list(weights.keys())] * pd.Series(weights)).mean(axis=1)
-    tcm_and_score['Importance Score'] = (tcm_and_score[list(weights.keys())] * pd.Series(weights)).mean(axis=1)
-    chem_and_score['Importance Score'] = (chem_and_score[list(weights.keys())] * pd.Series(weights)).mean(axis=1)
+    # 加权计算各复方、中药、成分（化合物）的HerbiV Score：默认为各靶点HerbiV Score的平均值，
+    # 指定权重时为经验证和归一化的权重下的加权和
+    if weights is not None:
+        weights = normalize_weights(pd.DataFrame([weights]), proteins_id).to_numpy()[0]
+    for items_and_score in (formula_and_score, tcm_and_score, chem_and_score):
+        if items_and_score is None:
+            continue
+        if weights is None:
+            items_and_score['Importance Score'] = items_and_score[columns].mean(axis=1)
+        else:
+            items_and_score['Importance Score'] = items_and_score[columns].to_numpy(dtype=float) @ weights
 
     # 根据Importance Score降序排序
     if formula is not None:
@@ -150,14 +175,343 @@ def score(tcm: pd.DataFrame,
     return tcm_and_score, chem_and_score, formula_and_score
 
 
-def component(items_and_score, random_state=None, num=1000, c=10):
+@instrument.staged('compute.score_scenarios')
+def score_scenarios(tcm: pd.DataFrame,
+                    tcm_chem_links: pd.DataFrame,
+                    chem: pd.DataFrame,
+                    chem_protein_links: pd.DataFrame,
+                    weights,
+                    formula: Union[pd.DataFrame, None] = None,
+                    formula_tcm_links: Union[pd.DataFrame, None] = None,
+                    cache_key: Union[tuple, None] = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+        在多组靶点（蛋白）权重（如按表达量或通路加权的不同情景）下计算复方、中药和化合物的Importance Score及排名。
+        各靶点的HerbiV Score只由score计算一次，各层节点×靶点的HerbiV Score矩阵合并后与归一化的权重矩阵相乘一次，
+        得到全部情景下的Importance Score。
+
+        Args:
+            tcm: 同score。
+            tcm_chem_links: 同score。
+            chem: 同score。
+            chem_protein_links: 同score。
+            weights: 多组权重，格式见normalize_weights。
+            formula: 同score。默认为None。
+            formula_tcm_links: 同score。默认为None。
+            cache_key: 同score。默认为None。
+
+        Returns:
+            与score的返回值相同（Importance Score为各靶点权重相等时的值，按其降序排序），并为每个情景name新增
+            '<name> Importance Score'列及'<name> Rank'列（该情景下的排名，1为最高，Importance Score相同时按表中的顺序）。
+
+            tcm_and_score: 中药信息及HerbiV Score。
+            chem_and_score: 成分（化合物）信息及HerbiV Score。
+            formula_and_score: 复方信息及HerbiV Score。
+
+        Examples:
+            >>> weights = pd.DataFrame({'ENSP00000381588': [1, 3], 'ENSP00000252519': [1, 1]},
+            ...                        index=['equal', 'expression'])
+            >>> tcm_info, chem_info, formula_info = score_scenarios(tcm_info, tcm_chem_links_info, chem_info,
+            ...                                                     chem_protein_links_info, weights,
+            ...                                                     formula_info, formula_tcm_links_info)
+            >>> tcm_info[['HVMID', 'equal Importance Score', 'expression Importance Score', 'expression Rank']]
+    """
+    tcm_and_score, chem_and_score, formula_and_score = score(tcm, tcm_chem_links, chem, chem_protein_links, formula,
+                                                             formula_tcm_links, cache_key=cache_key)
+    proteins_id = np.asarray(chem_protein_links['Ensembl_ID'].unique(), dtype=object)
+    matrix = normalize_weights(weights, proteins_id)
+    columns = list(proteins_id + ' HerbiV Score')
+
+    # 各层节点×靶点的HerbiV Score矩阵合并为一个矩阵，与权重矩阵（靶点×情景）相乘一次
+    tables = [table for table in (tcm_and_score, chem_and_score, formula_and_score) if table is not None]
+    importance = np.vstack([table[columns].to_numpy(dtype=float) for table in tables]) @ matrix.to_numpy().T
+
+    results = []
+    start = 0
+    for table in tables:
+        values = importance[start:start + len(table)]
+        start += len(table)
+
+        # 各情景下的排名：按Importance Score降序，相同时按表中的顺序
+        order = np.argsort(-values, axis=0, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(1, len(table) + 1)[:, None], axis=0)
+
+        added = {}
+        for i, name in enumerate(matrix.index):
+            added[f'{name} Importance Score'] = values[:, i]
+            added[f'{name} Rank'] = ranks[:, i]
+        results.append(pd.concat([table, pd.DataFrame(added, index=table.index)], axis=1))
+
+    if formula_and_score is None:
+        results.append(None)
+    return tuple(results)
+
+
+def normalize_weights(weights, proteins_id) -> pd.DataFrame:
+    """
+        验证多组靶点（蛋白）权重并将每组归一化为和为1。
+
+        Args:
+            weights: 多组权重，可以为：DataFrame（每行为一个情景，行索引为情景的名称，列为Ensembl_ID或
+                     '<Ensembl_ID> HerbiV Score'，缺失值视为0）；{情景的名称: {Ensembl_ID: 权重}}的字典；
+                     或各列与proteins_id一一对应的二维数组（情景的名称为0, 1, 2...）。未给出的靶点权重为0。
+            proteins_id: 靶点的Ensembl_ID，与HerbiV Score矩阵的各列对应。
+
+        Returns:
+            行为各情景、列为proteins_id的DataFrame，每行的和为1。
+
+        Raises:
+            ValueError: 权重的形状与proteins_id不符、包含不在proteins_id中或重复的靶点、包含负数或无穷大，
+                        或某一情景的权重之和为0。
+
+        Examples:
+            >>> normalize_weights({'expression': {'ENSP00000381588': 3, 'ENSP00000252519': 1}},
+            ...                   ['ENSP00000381588', 'ENSP00000252519'])
+                        ENSP00000381588  ENSP00000252519
+            expression             0.75             0.25
+    """
+    proteins_id = pd.Index(proteins_id)
+    if isinstance(weights, pd.DataFrame):
+        table = weights
+    elif isinstance(weights, dict):
+        table = pd.DataFrame.from_dict(weights, orient='index')
+    else:
+        values = np.asarray(weights, dtype=float)
+        if values.ndim != 2 or values.shape[1] != len(proteins_id):
+            raise ValueError(f"weights must be a 2-D array with one column per protein ({len(proteins_id)}), "
+                             f"got shape {values.shape}.")
+        table = pd.DataFrame(values, columns=proteins_id)
+
+    # 列名可以为'<Ensembl_ID> HerbiV Score'
+    table = table.rename(columns=lambda column: column[:-len(' HerbiV Score')]
+                         if isinstance(column, str) and column.endswith(' HerbiV Score') else column)
+    if table.columns.duplicated().any():
+        raise ValueError(f"Duplicate proteins in weights: {list(table.columns[table.columns.duplicated()])}.")
+    unknown = table.columns[~table.columns.isin(proteins_id)]
+    if len(unknown):
+        raise ValueError(f"Weights are given for proteins that are not scored: {list(unknown)}.")
+
+    values = table.reindex(columns=proteins_id).to_numpy(dtype=float, copy=True)
+    values[np.isnan(values)] = 0
+    if np.isinf(values).any() or (values < 0).any():
+        raise ValueError("Weights must be finite and non-negative.")
+    sums = values.sum(axis=1)
+    if (sums <= 0).any():
+        raise ValueError(f"The weights of scenario(s) {list(table.index[sums <= 0])} sum to zero.")
+
+    return pd.DataFrame(values / sums[:, None], index=table.index, columns=proteins_id)
+
+
+def _propagate(ids, link_source, link_target, target_ids, target_unique, target_log):
+    """
+        由下一层节点的sum(log(1 - s))矩阵计算本层节点的sum(log(1 - s))矩阵（即关联矩阵与下一层矩阵的乘积）。
+        与逐个节点计算时一致，各节点的每个下层节点只计一次，下层节点在表中重复出现时按出现次数计。
+
+        Args:
+            ids: 本层节点的ID。
+            link_source: 连接信息中本层节点的ID。
+            link_target: 连接信息中下层节点的ID。
+            target_ids: 下层节点的ID（可重复）。
+            target_unique: 下层节点不重复的ID，与target_log的各行对应。
+            target_log: 下层节点×蛋白的sum(log(1 - s))矩阵。
+
+        Returns:
+            本层节点不重复的ID及本层节点×蛋白的sum(log(1 - s))矩阵。
+    """
+
+    unique = pd.Index(pd.unique(ids))
+    rows = unique.get_indexer(link_source)
+    cols = target_unique.get_indexer(link_target)
+
+    # 去除重复的及不在表中的连接
+    valid = (rows >= 0) & (cols >= 0)
+    pairs = np.unique(np.stack([rows[valid], cols[valid]], axis=1), axis=0).reshape(-1, 2)
+
+    # 下层节点在表中出现的次数
+    counts = np.bincount(target_unique.get_indexer(target_ids), minlength=len(target_unique))
+
+    log = np.zeros((len(unique), target_log.shape[1]))
+    order = np.argsort(pairs[:, 0], kind='stable')
+    pairs = pairs[order]
+    if len(pairs):
+        starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]])
+        log[pairs[starts, 0]] = np.add.reduceat(target_log[pairs[:, 1]] * counts[pairs[:, 1], None], starts, axis=0)
+
+    return unique, log
+
+
+def _cached_tcm_log(ids, tcm_chem_links, chem, chem_ids, chem_log, proteins, cache_key):
+    """
+        计算中药×蛋白的sum(log(1 - s))矩阵，已缓存的中药直接使用缓存的向量，其余中药由化合物层计算后加入缓存。
+
+        Args:
+            ids: 中药的ID。
+            tcm_chem_links: 中药-化合物连接信息。
+            chem: 化合物信息。
+            chem_ids: 化合物不重复的ID，与chem_log的各行对应。
+            chem_log: 化合物×蛋白的sum(log(1 - s))矩阵。
+            proteins: 蛋白的ID，与chem_log的各列对应。
+            cache_key: (score, 靶点集合)。
+
+        Returns:
+            中药不重复的ID及中药×蛋白的sum(log(1 - s))矩阵。
+    """
+
+    unique = pd.Index(pd.unique(ids))
+    entries = _tcm_entries(unique, cache_key)
+
+    log = np.zeros((len(unique), len(proteins)))
+    cached = [k for k, entry in enumerate(entries) if 'log' in entry]
+    missing = [k for k, entry in enumerate(entries) if 'log' not in entry]
+    if missing:
+        _, missing_log = _propagate(unique[missing], tcm_chem_links['HVMID'], tcm_chem_links['HVCID'],
+                                    chem['HVCID'], chem_ids, chem_log)
+        log[missing] = missing_log
+        # 仅缓存非零的项（蛋白的ID及其值）
+        for k, row in zip(missing, missing_log):
+            nonzero = np.flatnonzero(row)
+            entries[k]['log'] = (proteins[nonzero].to_numpy(), row[nonzero])
+
+    for k in cached:
+        cols = proteins.get_indexer(entries[k]['log'][0])
+        log[k, cols[cols >= 0]] = entries[k]['log'][1][cols >= 0]
+
+    return unique, log
+
+
+def _tcm_entries(ids, cache_key) -> list:
     """
-    :param random_state:
+        获取各中药在cache_key下的缓存条目，不存在时创建空的条目。条目为字典，'links'为该中药的有效连接
+        （由analysis在查询连接时写入），'log'为中药×蛋白的sum(log(1 - s))向量中非零的项（由score写入）。
+
+        Args:
+            ids: 中药不重复的ID。
+            cache_key: (score, 靶点集合)。
+
+        Returns:
+            与ids对应的缓存条目。
+    """
+
+    version = dataset.version(TCM_SCORE_DATASETS)
+    entries = []
+    for tcm_id in ids:
+        key = (tcm_id,) + tuple(cache_key) + (version,)
+        entry = _tcm_scores.get(key)
+        if entry is None:
+            entry = {}
+            _tcm_scores.put(key, entry)
+        entries.append(entry)
+    return entries
+
+
+class ScoreCache:
+    """
+        按最近最少使用的顺序淘汰条目的缓存，条目数不超过maxsize，可在多个线程中使用。
+
+        Args:
+            maxsize (int): 条目数的上限。
+
+        Examples:
+            >>> cache = ScoreCache(2)
+            >>> cache.put('a', 1)
+            >>> cache.put('b', 2)
+            >>> cache.get('a')
+            1
+            >>> cache.put('c', 3)# 淘汰最近最少使用的'b'
+            >>> cache.get('b') is None
+            True
+    """
+
+    def __init__(self, maxsize=TCM_SCORE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+            获取key对应的条目并将其标记为最近使用，不存在时返回default。
+        """
+
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        """
+            添加或更新条目，条目数超过上限时淘汰最近最少使用的条目。
+        """
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def resize(self, maxsize):
+        """
+            修改条目数的上限，并淘汰超出上限的条目。
+        """
+
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """
+            清空缓存。
+        """
+
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+# 各中药的缓存条目（见_tcm_entries），键为(HVMID, score, 靶点集合, 数据集版本)
+_tcm_scores = ScoreCache(TCM_SCORE_CACHE_SIZE)
+
+
+def tcm_score_cache() -> ScoreCache:
+    """
+        获取各中药的缓存条目（有效连接及中药×蛋白的向量，见_tcm_entries）所在的缓存，可用于查看命中次数、
+        修改条目数的上限（resize）或清空缓存（clear）。
+    """
+
+    return _tcm_scores
+
+
+def _add_scores(items_and_score, rows, log, columns):
+    # 将各蛋白的HerbiV Score（1 - exp(sum(log(1 - s)))）添加至items_and_score
+    scores = pd.DataFrame(-np.expm1(log[rows]), columns=columns, index=items_and_score.index)
+    return pd.concat([items_and_score, scores], axis=1)
+
+
+@instrument.staged('compute.component')
+def component(items_and_score, random_state=None, num=1000, c=10, workers=None):
+    """
+    :param random_state: 随机数种子，相同的random_state在任意workers下得到相同的结果
     :param tcm:
     :param items_and_score: pd存储复方/中药信息
-    :param num: 需要的解的组数
+    :param num: 抽样求解的次数，即需要的解的组数。与之前接受的解冲突或重复的解以之前接受的全部解为约束重新求解；
+                重新求解后仍重复的解（仅在解只含一个中药/复方时可能出现）不计入结果
+    :param workers: 并行求解使用的进程数，默认为None（在当前进程中求解）
     :return:
     """
+    # tqdm仅在求解时导入
+    from tqdm import tqdm
+
     if 'HVPID' in items_and_score.columns:
         by = 'HVPID'
         name = 'name'
@@ -167,25 +521,39 @@ def component(items_and_score, random_state=None, num=1000, c=10):
 
     dps = []
     items_ls = []
-    n = len(items_and_score)
-    weights = [1 for _ in range(n)]
-    names = [*items_and_score.loc[:, by]]
-    values = [*items_and_score.loc[:, 'Importance Score']]
-    n = ceil(len(weights) / 10)
-
-    if random_state is not None:
-        random.seed(random_state)
-
-    for _ in tqdm(range(num)):
-        random_indices = random.sample(range(len(weights)), n)
-        weights = [weights[i] for i in random_indices]
-        names = [names[i] for i in random_indices]
-        values = [values[i] for i in random_indices]
-
-        # 不能再得出之前的解
-        dp, items = knapsack(weights, n, items_ls, names, values, c)
-        dps.append(dp)
-        items_ls.append(items)
+    solutions = SolutionIndex(items_and_score.loc[:, by])
+    names = np.asarray(items_and_score.loc[:, by], dtype=object)
+    values = items_and_score.loc[:, 'Importance Score'].to_numpy(dtype=float)
+    n = ceil(len(names) / 10)
+
+    # 将num次抽样按固定大小分块，每块由random_state派生出独立的随机数种子，分块方式与进程数无关
+    sizes = [min(COMPONENT_BLOCK_SIZE, num - start) for start in range(0, num, COMPONENT_BLOCK_SIZE)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    args = [(names, values, n, c, size, seed) for size, seed in zip(sizes, seeds)]
+
+    if workers is None or workers <= 1:
+        blocks = (_component_block(*arg) for arg in args)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        blocks = executor.map(_component_block, *zip(*args))
+
+    try:
+        # 按抽样顺序合并各块的解：各块的解只避开了块内之前的解，与之前接受的解重复或冲突（含有出现在同一个之前接受的
+        # 解中的两个中药/复方）时，以之前接受的全部解为约束重新求解该次抽样，合并的结果与进程数无关
+        weights = [1] * n
+        with tqdm(total=num) as progress:
+            for block in blocks:
+                for random_indices, dp, items in block:
+                    if solutions.conflicts(items) or items in solutions:
+                        dp, items = knapsack(weights, n, solutions, list(names[random_indices]),
+                                             values[random_indices], c)
+                    if solutions.add(items):
+                        dps.append(dp)
+                        items_ls.append(items)
+                progress.update(len(block))
+    finally:
+        if workers is not None and workers > 1:
+            executor.shutdown()
 
     # 用pd.DataFrame存储结果
     components = pd.DataFrame(dps)
@@ -208,6 +576,20 @@ def component(items_and_score, random_state=None, num=1000, c=10):
     return components
 
 
+def _component_block(names, values, n, c, size, seed):
+    # 求解一块抽样：每次从全部中药/复方中不放回地抽取n个，块内的解不能重复或冲突；返回各次抽样的下标、最优值及解
+    rng = np.random.default_rng(seed)
+    solutions = SolutionIndex()
+    results = []
+    weights = [1] * n
+    for _ in range(size):
+        random_indices = rng.choice(len(names), n, replace=False)
+        dp, items = knapsack(weights, n, solutions, list(names[random_indices]), values[random_indices], c)
+        solutions.add(items)
+        results.append((random_indices, dp, items))
+    return results
+
+
 def boost(row, items_and_score, by):
     ls = row['items'].split(';')
     scores = [*items_and_score.loc[items_and_score[by].isin(ls)]['Importance Score']]
@@ -215,37 +597,62 @@ def boost(row, items_and_score, by):
 
 
 def knapsack(weights, n, forbidden_combinations, names, values, c=10):
-    # 创建一个二维列表用于存储计算结果
-    dp = [[0] * (c + 1) for _ in range(n + 1)]
-    # 创建一个二维列表用于记录选择的中药/复方
-    items = [[""] * (c + 1) for _ in range(n + 1)]
-
-    for i in range(1, n + 1):
-        for j in range(1, c + 1):
-            if weights[i - 1] <= j:
-                # 检查当前是否与禁止组合冲突
-                conflict = False
-                for combination in forbidden_combinations:
-                    if names[i - 1] in combination and any(
-                            item in items[i - 1][j - weights[i - 1]] for item in combination):
-                        conflict = True
-                        break
-                if conflict:
-                    dp[i][j] = dp[i - 1][j]
-                    items[i][j] = items[i - 1][j]
-                else:
-                    if 1 - (1 - values[i - 1]) * (1 - dp[i - 1][j - weights[i - 1]]) > dp[i - 1][j]:
-                        dp[i][j] = 1 - (1 - values[i - 1]) * (1 - dp[i - 1][j - weights[i - 1]])
-                        items[i][j] = names[i - 1] + ", " + items[i - 1][j - weights[i - 1]]
-                    else:
-                        dp[i][j] = dp[i - 1][j]
-                        items[i][j] = items[i - 1][j]
-            else:
-                dp[i][j] = dp[i - 1][j]
-                items[i][j] = items[i - 1][j]
-
-    # 优化中药/复方存储
-    items = [s[:-2] for s in items[-1]]
+    """
+        使用动态规划求解以noisy-OR（1 - prod(1 - Importance Score)）为目标的0-1背包问题，
+        每一列（容量）的状态转移以数组运算完成，并以回溯指针记录选择的中药/复方。
+
+        Args:
+            weights: 各中药/复方的重量（均为正整数）。
+            n: 参与求解的中药/复方数。
+            forbidden_combinations: 之前得到的解（SolutionIndex或中药/复方ID的列表的列表），
+                                    同一个解中的任意两个中药/复方不能再同时被选择。
+            names: 各中药/复方的ID。
+            values: 各中药/复方的Importance Score。
+            c: 背包的容量，即最多选择的中药/复方数。
+
+        Returns:
+            根据最大似然估计确定的中药/复方数对应的最优值及选择的中药/复方的ID（后选择的在前）。
+    """
+
+    weights = np.asarray(weights[:n], dtype=int)
+    values = np.asarray(values[:n], dtype=float)
+    rows = np.arange(n + 1)
+
+    # dp[i][j]：前i个中药/复方在容量为j时的最优值；take[i][j]：该最优解是否选择了第i个中药/复方（回溯指针）
+    dp = np.zeros((n + 1, c + 1))
+    take = np.zeros((n + 1, c + 1), dtype=bool)
+
+    # chosen[j][i][k]：前i个中药/复方在容量为j时的最优解是否选择了第k个中药/复方
+    chosen = np.zeros((c + 1, n + 1, n), dtype=bool)
+
+    # conflicts[i][k]：第i个与第k个中药/复方出现在同一个之前得到的解中，不能同时被选择
+    if not isinstance(forbidden_combinations, SolutionIndex):
+        forbidden_combinations = SolutionIndex(combinations=forbidden_combinations)
+    conflicts = forbidden_combinations.partner_matrix(names[:n])
+    has_conflicts = conflicts.any()
+
+    # 按容量逐列计算：第j列只依赖于容量更小的列，在列内dp[i][j] = max(dp[i - 1][j], 选择第i个时的值)为前缀最大值
+    for j in range(1, c + 1):
+        source = j - weights
+        fits = source >= 0
+        source = np.where(fits, source, 0)
+
+        # 选择第i个中药/复方时的值，容量不足或与之前得到的解冲突时不能选择
+        candidate = 1 - (1 - values) * (1 - dp[rows[:-1], source])
+        if has_conflicts:
+            fits &= ~(chosen[source, rows[:-1]] & conflicts).any(axis=1)
+        candidate = np.where(fits, candidate, -np.inf)
+
+        best = np.maximum.accumulate(np.concatenate([[0.0], candidate]))
+        take[1:, j] = candidate > best[:-1]
+        dp[:, j] = best
+
+        # 第i行的最优解为最近一次选择的中药/复方（第last行）加上第last - 1行、容量为j - weights[last - 1]时的最优解
+        last = np.maximum.accumulate(np.where(take[:, j], rows, 0))
+        selected = last > 0
+        item = last[selected] - 1
+        chosen[j, selected] = chosen[j - weights[item], item]
+        chosen[j, np.flatnonzero(selected), item] = True
 
     # 计算累计Score比例
     score_ratio = np.cumsum(dp[-1]) / np.sum(dp)
@@ -257,7 +664,106 @@ def knapsack(weights, n, forbidden_combinations, names, values, c=10):
     num_components = np.argmin(mle_estimates) + 1
     num_components = 2 if num_components <= 1 else num_components
 
-    return dp[-1][num_components], items[num_components].split(', ')
+    # 根据回溯指针得到选择的中药/复方
+    items = []
+    j = num_components
+    for i in range(n, 0, -1):
+        if take[i][j]:
+            items.append(names[i - 1])
+            j -= weights[i - 1]
+
+    return dp[-1][num_components], items
+
+
+class SolutionIndex:
+    """
+        已得到的中药/复方组合（解）的索引。各解以中药/复方整数编码的frozenset存储，并维护中药/复方到解的倒排索引，
+        判断两个中药/复方能否同时被选择及判断解是否重复的耗时均与已得到的解的数量无关。
+
+        Args:
+            names: 各中药/复方的ID，按顺序编码为0, 1, 2...（未列出的ID在首次出现时编码）。默认为None。
+            combinations: 初始的解（中药/复方ID的列表的列表）。默认为None。
+
+        Examples:
+            >>> solutions = SolutionIndex(['HVM0367', 'HVM1695', 'HVM0735'])
+            >>> solutions.add(['HVM0367', 'HVM1695'])
+            True
+            >>> solutions.add(['HVM1695', 'HVM0367'])# 重复的解
+            False
+            >>> solutions.partners('HVM0367')
+            {'HVM1695'}
+    """
+
+    def __init__(self, names=None, combinations=None):
+        self.codes = {}
+        self.names = []
+        self.solutions = set()
+        # 倒排索引：中药/复方的编码 -> 包含它的解
+        self.by_item = {}
+        # 中药/复方的编码 -> 与其出现在同一个解中的中药/复方的编码
+        self._partners = {}
+
+        for name in [] if names is None else names:
+            self.encode(name)
+        for combination in [] if combinations is None else combinations:
+            self.add(combination)
+
+    def encode(self, name) -> int:
+        # 中药/复方的整数编码
+        if name not in self.codes:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+        return self.codes[name]
+
+    def add(self, items) -> bool:
+        """
+            添加一个解，解已存在时返回False。
+        """
+
+        solution = frozenset(self.encode(item) for item in items if item != '')
+        if solution in self.solutions:
+            return False
+
+        self.solutions.add(solution)
+        for code in solution:
+            self.by_item.setdefault(code, []).append(solution)
+            self._partners.setdefault(code, set()).update(solution - {code})
+
+        return True
+
+    def conflicts(self, items) -> bool:
+        """
+            判断items中是否有两个中药/复方出现在同一个之前得到的解中。
+        """
+
+        codes = [self.codes[item] for item in items if item in self.codes]
+        return any(self._partners.get(code, set()).intersection(codes) for code in codes)
+
+    def partner_matrix(self, names) -> np.ndarray:
+        """
+            返回names中的中药/复方两两之间能否同时被选择的矩阵，第i行第k列为True时二者出现在同一个解中。
+        """
+
+        position = {self.codes[name]: k for k, name in enumerate(names) if name in self.codes}
+        matrix = np.zeros((len(names), len(names)), dtype=bool)
+        for code, k in position.items():
+            ks = [position[p] for p in self._partners.get(code, ()) if p in position]
+            matrix[k, ks] = True
+        return matrix
+
+    def partners(self, name) -> set:
+        """
+            返回与name出现在同一个解中的中药/复方的ID，它们不能再与name同时被选择。
+        """
+
+        code = self.codes.get(name)
+        return {self.names[p] for p in self._partners.get(code, ())}
+
+    def __contains__(self, items):
+        return frozenset(self.codes.get(item, -1) for item in items) in self.solutions
+
+    def __len__(self):
+        return len(self.solutions)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,676 @@
+import os
+import json
+import hashlib
+import warnings
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from herbiv import instrument
+
+# 随包发布的数据集所在目录
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# 数据集所在目录，可通过环境变量HERBIV_DATA_DIR或set_data_dir指定（如使用benchmarks中生成的数据集）
+DATA_DIR = os.environ.get('HERBIV_DATA_DIR', DEFAULT_DATA_DIR)
+
+# 各ID命名空间及包含该ID的数据集
+NAMESPACES = {
+    'HVPID': ['formula', 'formula_tcm_links'],
+    'HVMID': ['tcm', 'formula_tcm_links', 'tcm_chem_links'],
+    'HVCID': ['chemicals', 'tcm_chem_links', 'chem_protein_links'],
+    'Ensembl_ID': ['proteins', 'chem_protein_links'],
+}
+
+# 各连接数据集及其连接的两类ID
+LINKS = {
+    'formula_tcm_links': ('HVPID', 'HVMID'),
+    'tcm_chem_links': ('HVMID', 'HVCID'),
+    'chem_protein_links': ('HVCID', 'Ensembl_ID'),
+}
+
+# 编译后的二进制快照所在目录
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+
+# 快照格式的版本号，格式变化时递增
+SNAPSHOT_VERSION = 1
+
+# 各数据集的名称及其对应的文件
+DATASETS = {
+    'formula': 'HerbiV_formula.csv',
+    'formula_tcm_links': 'HerbiV_formula_tcm_links.csv',
+    'tcm': 'HerbiV_tcm.csv',
+    'tcm_chem_links': 'HerbiV_tcm_chemical_links.csv',
+    'chemicals': 'HerbiV_chemicals.csv',
+    'chem_protein_links': 'HerbiV_chemical_protein_links.csv',
+    'proteins': 'HerbiV_proteins.csv',
+}
+
+# 已加载的数据集（按最近使用的先后排列）及其占用的内存（字节）
+_tables = OrderedDict()
+_sizes = {}
+
+# 已读取的快照manifest（以快照目录为键）
+_manifests = {}
+
+# 由数据集派生的数据（ID的编码表、整数编码的列等），释放数据集时不会被释放
+_derived = {}
+
+# 各数据集的版本号，数据集被clear或reload时递增，用于使由其计算得到的缓存失效
+_versions = {}
+
+# 各数据集文件的校验和（以文件路径为键，文件大小和修改时间不变时不再重新计算）
+_checksums = {}
+
+# 内存上限（字节），为None时不限制
+_memory_limit = None
+
+_lock = threading.RLock()
+
+
+def load(name=None):
+    """
+        加载数据集并常驻内存，同一进程中每个数据集只会被读取一次。
+        Load dataset(s) and keep them resident, so that each dataset is read only once per process.
+
+        Args:
+            name (str): 数据集的名称（DATASETS的键），为None时加载全部数据集。
+            Name of the dataset (key of DATASETS), all datasets will be loaded if None.
+
+        Returns:
+            pandas.DataFrame: 名为name的数据集（name为None时返回None）。请勿原地修改返回的DataFrame。
+            Dataset named name (None if name is None). Do not modify the returned DataFrame in place.
+
+        Examples:
+            >>> load('tcm')# 获取HerbiV_tcm数据集
+                    HVMID   cn_name  ... SymMap_id TCMSP_id
+            0     HVM0000   阿比西尼亚刺桐  ...       NaN      NaN
+            1     HVM0001  阿比西尼亚牛筋果  ...       NaN      NaN
+            ...       ...       ...  ...       ...      ...
+            4665  HVM4665       酢浆草  ...       NaN      NaN
+            [4666 rows x 19 columns]
+    """
+
+    if name is None:
+        for n in DATASETS:
+            load(n)
+        return None
+
+    if name not in DATASETS:
+        raise KeyError(f"Unknown dataset: {name}. Available datasets: {', '.join(DATASETS)}.")
+
+    with _lock:
+        if name in _tables:
+            # 标记为最近使用
+            _tables.move_to_end(name)
+            return _tables[name]
+
+        with instrument.stage(f'dataset.load.{name}') as record:
+            table = _read(name)
+            record.rows_out = len(table)
+        _tables[name] = table
+        _sizes[name] = int(table.memory_usage(index=True, deep=True).sum())
+        _evict(keep=name)
+
+        return table
+
+
+def reload(name=None):
+    """
+        重新从磁盘读取数据集（如数据集文件或快照被更新后）。
+        Re-read dataset(s) from disk (e.g. after the dataset files are updated).
+
+        Args:
+            name (str): 数据集的名称，为None时重新加载全部数据集。Name of the dataset, all datasets if None.
+
+        Returns:
+            pandas.DataFrame: 名为name的数据集（name为None时返回None）。Dataset named name (None if name is None).
+    """
+
+    with _lock:
+        clear(name)
+        return load(name)
+
+
+def clear(name=None):
+    """
+        释放已加载的数据集及由其派生的数据（ID编码等）。
+        Release loaded dataset(s) and the data derived from them (ID codes, etc.).
+
+        Args:
+            name (str): 数据集的名称，为None时释放全部数据集。Name of the dataset, all datasets if None.
+    """
+
+    with _lock:
+        for n in list(_tables) if name is None else [name]:
+            _release(n)
+
+        for n in DATASETS if name is None else [name]:
+            _versions[n] = _versions.get(n, 0) + 1
+
+        for key in list(_derived):
+            if name is None or name in _derived[key][0]:
+                del _derived[key]
+
+        # 快照可能已被更新，下次加载时重新读取manifest
+        _manifests.clear()
+
+
+def version(names=None) -> int:
+    """
+        获取数据集的版本号，数据集每次被clear或reload后版本号增大，可作为由数据集计算得到的缓存的键的一部分。
+        Get the version of dataset(s), which increases every time they are cleared or reloaded,
+        so it can be used as part of the key of caches computed from the datasets.
+
+        Args:
+            names (collections.abc.Iterable): 数据集的名称，可以为单个名称，为None时为全部数据集。
+            Names of the datasets, a single name, or all datasets if None.
+
+        Returns:
+            int: 这些数据集的版本号之和。Sum of the versions of these datasets.
+
+        Examples:
+            >>> version(['tcm', 'tcm_chem_links'])
+            0
+    """
+
+    names = DATASETS if names is None else [names] if isinstance(names, str) else names
+    with _lock:
+        return sum(_versions.get(n, 0) for n in names)
+
+
+def checksum(names=None) -> str:
+    """
+        获取数据集文件的校验和，数据集文件被修改后校验和随之改变，可作为保存在磁盘上的缓存的键的一部分。
+        Get the checksum of the dataset files, which changes whenever the files are modified,
+        so it can be used as part of the key of caches stored on disk.
+
+        Args:
+            names (collections.abc.Iterable): 数据集的名称，可以为单个名称，为None时为全部数据集。
+            Names of the datasets, a single name, or all datasets if None.
+
+        Returns:
+            str: 这些数据集文件的SHA-256校验和合并后的SHA-256校验和。
+            SHA-256 of the SHA-256 checksums of these dataset files.
+
+        Examples:
+            >>> checksum('tcm')
+            '3f1c...'
+    """
+
+    names = DATASETS if names is None else [names] if isinstance(names, str) else names
+    h = hashlib.sha256()
+    for name in sorted(names):
+        h.update(f'{name}:{_source_checksum(name)};'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def set_data_dir(directory=None):
+    """
+        指定数据集所在的目录，并释放已加载的数据集及由其派生的数据，之后的分析均使用该目录中的数据集。
+        Set the directory of the datasets and release the loaded datasets and the data derived from them,
+        so that subsequent analyses use the datasets in this directory.
+
+        Args:
+            directory (str): 数据集所在的目录（其中的文件名见DATASETS，快照位于其中的snapshot目录），
+            为None时恢复为随包发布的数据集。
+            Directory of the datasets (file names as in DATASETS, snapshot in its snapshot subdirectory),
+            the bundled datasets if None.
+
+        Examples:
+            >>> set_data_dir('benchmarks/data/scale-1')
+            >>> set_data_dir()# 恢复为随包发布的数据集
+    """
+
+    global DATA_DIR, SNAPSHOT_DIR
+    with _lock:
+        DATA_DIR = DEFAULT_DATA_DIR if directory is None else os.path.abspath(directory)
+        SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+        clear()
+
+
+def set_memory_limit(limit=None):
+    """
+        设置常驻内存的数据集占用内存的上限，超出上限时将释放最久未使用的数据集。
+        Set the memory cap of the resident datasets, the least recently used datasets will be released beyond it.
+
+        Args:
+            limit (int): 内存上限（字节），为None时不限制。单个数据集超出上限时仍会被加载。
+            Memory cap in bytes, unlimited if None. A single dataset exceeding the cap is still loaded.
+    """
+
+    global _memory_limit
+
+    if limit is not None and limit < 0:
+        raise ValueError(f"The memory limit should be no less than 0, got {limit}.")
+
+    with _lock:
+        _memory_limit = limit
+        _evict()
+
+
+def memory_usage() -> int:
+    """
+        返回常驻内存的数据集占用的内存（字节）。
+        Return the memory (in bytes) used by the resident datasets.
+    """
+
+    with _lock:
+        return sum(_sizes.values())
+
+
+def vocabulary(namespace) -> pd.Index:
+    """
+        返回ID命名空间的编码表，ID的整数编码即其在编码表中的位置。
+        Return the vocabulary of an ID namespace, the integer code of an ID is its position in the vocabulary.
+
+        Args:
+            namespace (str): ID命名空间（NAMESPACES的键），如'HVCID'。ID namespace (key of NAMESPACES), e.g. 'HVCID'.
+
+        Returns:
+            pandas.Index: 按升序排列的该命名空间中所有的ID。All IDs of the namespace in ascending order.
+    """
+
+    return derive(('vocabulary', namespace), NAMESPACES[namespace],
+                   lambda: _build_vocabulary({name: load(name) for name in NAMESPACES[namespace]}, namespace))
+
+
+def encode(namespace, ids) -> np.ndarray:
+    """
+        将ID编码为int32整数。
+        Encode IDs into int32 codes.
+
+        Args:
+            namespace (str): ID命名空间。ID namespace.
+            ids (collections.abc.Iterable): 要编码的ID。IDs to be encoded.
+
+        Returns:
+            numpy.ndarray: 各ID的编码，不在数据集中的ID编码为-1。Codes of the IDs, -1 for IDs not in the datasets.
+
+        Examples:
+            >>> encode('HVMID', ['HVM0367', 'HVM1695'])
+            array([ 367, 1695], dtype=int32)
+    """
+
+    # Series、Index和数组直接转换，避免逐个元素迭代
+    ids = pd.Index(ids) if isinstance(ids, (pd.Series, pd.Index, np.ndarray)) else pd.Index(list(ids))
+    return vocabulary(namespace).get_indexer(ids).astype(np.int32)
+
+
+def decode(namespace, codes) -> pd.Index:
+    """
+        将int32整数编码还原为ID。
+        Decode int32 codes back into IDs.
+
+        Args:
+            namespace (str): ID命名空间。ID namespace.
+            codes (numpy.ndarray): 要还原的编码。Codes to be decoded.
+
+        Returns:
+            pandas.Index: 各编码对应的ID，编码为-1时为缺失值。IDs of the codes, missing values for code -1.
+    """
+
+    return vocabulary(namespace).take(np.asarray(codes, dtype=np.intp), allow_fill=True)
+
+
+def codes(name, column) -> np.ndarray:
+    """
+        返回数据集中某一ID列的整数编码。
+        Return the integer codes of an ID column of a dataset.
+
+        Args:
+            name (str): 数据集的名称。Name of the dataset.
+            column (str): ID列的列名，同时也是其ID命名空间。Column name of the ID column, which is also its namespace.
+
+        Returns:
+            numpy.ndarray: 与数据集各行对应的int32编码。int32 codes aligned with the rows of the dataset.
+    """
+
+    return derive(('codes', name, column), NAMESPACES[column],
+                   lambda: encode(column, load(name)[column]))
+
+
+def links(name) -> dict:
+    """
+        返回以整数数组存储的连接数据集，各ID列均为int32编码，其余列为numpy数组。
+        Return a link dataset stored as integer arrays: ID columns as int32 codes, other columns as numpy arrays.
+
+        Args:
+            name (str): 连接数据集的名称，如'formula_tcm_links'、'tcm_chem_links'或'chem_protein_links'。
+            Name of the link dataset, e.g. 'formula_tcm_links', 'tcm_chem_links' or 'chem_protein_links'.
+
+        Returns:
+            dict: 以列名为键的数组。Arrays keyed by column name.
+
+        Examples:
+            >>> links('tcm_chem_links')
+            {'HVMID': array([   0,    0, ..., 4665], dtype=int32), 'HVCID': array([6510, 5383, ...,  247], dtype=int32)}
+    """
+
+    def build():
+        table = load(name)
+        return {col: codes(name, col) if col in NAMESPACES else table[col].to_numpy() for col in table.columns}
+
+    return derive(('links', name), [n for namespace in LINKS[name] for n in NAMESPACES[namespace]], build)
+
+
+def score_index(by) -> dict:
+    """
+        返回HerbiV_chemical_protein_links数据集按化合物或蛋白分组、组内按Combined_score升序排列的索引（CSR格式）。
+        查询某化合物/蛋白combined_score不低于阈值的连接时仅需在其所在的组中二分查找。
+        Return the index (in CSR format) of the HerbiV_chemical_protein_links dataset grouped by chemical or protein,
+        with Combined_score sorted ascending within each group. Links of a chemical/protein whose combined_score
+        is no less than a threshold can be found by a binary search within its group.
+
+        Args:
+            by (str): 分组依据的列，'HVCID'或'Ensembl_ID'。Column to group by, 'HVCID' or 'Ensembl_ID'.
+
+        Returns:
+            dict: 'indptr'：编码为i的ID所在组为第indptr[i]至indptr[i + 1]个元素；'rows'：各连接在数据集中的行号；
+            'score'：各连接变换为0-1的float32格式的Combined_score。
+            'indptr': the group of the ID coded i spans elements indptr[i] to indptr[i + 1];
+            'rows': row numbers of the links in the dataset; 'score': Combined_score of the links scaled to 0-1 as float32.
+    """
+
+    def build():
+        persisted = _snapshot_index(by)
+        if persisted is not None:
+            return persisted
+        return _build_score_index(codes('chem_protein_links', by), len(vocabulary(by)),
+                                  links('chem_protein_links')['Combined_score'])
+
+    return derive(('score_index', by), NAMESPACES['HVCID'] + NAMESPACES['Ensembl_ID'], build)
+
+
+def _build_vocabulary(tables, namespace):
+    # 以升序排列的命名空间中所有的ID作为编码表
+    ids = pd.concat([table[namespace] for table in tables.values()]).dropna().unique()
+    return pd.Index(np.sort(ids))
+
+
+def _build_score_index(group_codes, n, scores):
+    # 按组及Combined_score排序（忽略编码为-1的行），Combined_score变换为0-1的float32
+    rows = np.flatnonzero(group_codes >= 0)
+    score = (np.asarray(scores, dtype=np.float64)[rows] / 1000).astype(np.float32)
+    order = np.lexsort((score, group_codes[rows]))
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(group_codes[rows], minlength=n), out=indptr[1:])
+
+    return {'indptr': indptr, 'rows': rows[order].astype(np.int64), 'score': score[order]}
+
+
+def derive(key, names, build):
+    """
+        获取由数据集派生的常驻内存的数据（如编码、索引等），首次使用时生成，数据集被clear或reload时一同释放。
+        Get resident data derived from datasets (codes, indexes, etc.), which is built on first use
+        and released together with the datasets on clear or reload.
+
+        Args:
+            key (collections.abc.Hashable): 派生数据的键。Key of the derived data.
+            names (collections.abc.Iterable): 派生数据所依赖的数据集的名称。Names of the datasets it derives from.
+            build (collections.abc.Callable): 生成派生数据的无参函数。Function without arguments that builds it.
+
+        Returns:
+            build生成的派生数据。The derived data built by build.
+    """
+
+    with _lock:
+        if key not in _derived:
+            _derived[key] = (set(names), build())
+        return _derived[key][1]
+
+
+def _release(name):
+    _tables.pop(name, None)
+    _sizes.pop(name, None)
+
+
+def _evict(keep=None):
+    # 按最近最少使用的顺序释放数据集（由其派生的数据仍常驻内存），直至占用的内存不超过上限
+    if _memory_limit is None:
+        return
+
+    for n in list(_tables):
+        if memory_usage() <= _memory_limit:
+            break
+        if n != keep:
+            _release(n)
+
+
+def compile_snapshot(directory=None):
+    """
+        将data目录中的csv数据集编译为按列存储的二进制快照（numpy的.npy文件及记录校验和的manifest.json）。
+        快照存在时，load将以内存映射的方式读取快照，不再解析csv文件。
+        Compile the csv datasets in the data directory into a columnar binary snapshot
+        (numpy .npy files and a manifest.json with checksums).
+        When the snapshot exists, load memory-maps it instead of parsing the csv files.
+
+        Args:
+            directory (str): 存放快照的目录，默认为SNAPSHOT_DIR。Directory of the snapshot, SNAPSHOT_DIR by default.
+
+        Returns:
+            dict: 快照的manifest。Manifest of the snapshot.
+
+        Examples:
+            >>> compile_snapshot()# 也可在命令行中执行python -m herbiv.dataset
+    """
+
+    directory = SNAPSHOT_DIR if directory is None else directory
+    manifest = {'version': SNAPSHOT_VERSION, 'tables': {}, 'indexes': {}}
+    tables = {}
+
+    for name, file in DATASETS.items():
+        source = os.path.join(DATA_DIR, file)
+        if not os.path.exists(source):
+            continue
+
+        table = tables[name] = pd.read_csv(source)
+        table_dir = os.path.join(directory, name)
+        os.makedirs(table_dir, exist_ok=True)
+
+        columns = []
+        for i, col in enumerate(table.columns):
+            columns.append(_write_column(table[col], table_dir, str(i)))
+
+        manifest['tables'][name] = {
+            'source': file,
+            'source_size': os.path.getsize(source),
+            'source_mtime': os.path.getmtime(source),
+            'source_sha256': _sha256(source),
+            'rows': int(table.shape[0]),
+            'columns': columns,
+        }
+
+    # 同时保存HerbiV_chemical_protein_links的索引（见score_index）
+    if all(name in tables for name in NAMESPACES['HVCID'] + NAMESPACES['Ensembl_ID']):
+        index_dir = os.path.join(directory, 'index')
+        os.makedirs(index_dir, exist_ok=True)
+        for by in LINKS['chem_protein_links']:
+            vocab = _build_vocabulary({name: tables[name] for name in NAMESPACES[by]}, by)
+            index = _build_score_index(vocab.get_indexer(tables['chem_protein_links'][by]).astype(np.int32),
+                                       len(vocab), tables['chem_protein_links']['Combined_score'])
+            files = {}
+            for field, array in index.items():
+                path = os.path.join(index_dir, f'score_index.{by}.{field}.npy')
+                np.save(path, array, allow_pickle=False)
+                files[os.path.basename(path)] = _sha256(path)
+            manifest['indexes'][f'score_index.{by}'] = {'files': files}
+
+    # manifest最后写入，写入中断时快照不会被使用
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    with _lock:
+        _manifests.pop(directory, None)
+
+    return manifest
+
+
+def verify_snapshot(directory=None) -> bool:
+    """
+        根据manifest中的校验和检查快照是否完整。
+        Check the integrity of the snapshot against the checksums in its manifest.
+
+        Args:
+            directory (str): 存放快照的目录，默认为SNAPSHOT_DIR。Directory of the snapshot, SNAPSHOT_DIR by default.
+
+        Returns:
+            bool: 快照存在且所有文件的校验和均一致时为True。True if the snapshot exists and all checksums match.
+    """
+
+    directory = SNAPSHOT_DIR if directory is None else directory
+    manifest = _manifest(directory)
+    if manifest is None:
+        return False
+
+    files = {os.path.join(directory, name, file): checksum
+             for name, info in manifest['tables'].items() for col in info['columns']
+             for file, checksum in col['files'].items()}
+    files.update({os.path.join(directory, 'index', file): checksum
+                  for info in manifest.get('indexes', {}).values() for file, checksum in info['files'].items()})
+
+    for path, checksum in files.items():
+        if not os.path.exists(path) or _sha256(path) != checksum:
+            return False
+
+    return True
+
+
+def _read(name):
+    # 优先读取快照，快照不存在或已过期时读取csv文件
+    info = _snapshot_info(name)
+    if info is None:
+        return pd.read_csv(os.path.join(DATA_DIR, DATASETS[name]))
+
+    # copy=False：数值列直接使用内存映射的数组，不复制到进程的私有内存中
+    table_dir = os.path.join(SNAPSHOT_DIR, name)
+    return pd.DataFrame({col['name']: _read_column(col, table_dir) for col in info['columns']},
+                        columns=[col['name'] for col in info['columns']], copy=False)
+
+
+def _source_checksum(name):
+    # 数据集文件的校验和：文件与快照记录的大小和修改时间一致时直接使用快照中的校验和；仅有快照时使用快照中的校验和
+    path = os.path.join(DATA_DIR, DATASETS[name])
+    if not os.path.exists(path):
+        info = _snapshot_info(name)
+        return '' if info is None else info['source_sha256']
+
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime)
+    with _lock:
+        if path not in _checksums or _checksums[path][0] != signature:
+            manifest = _manifest(SNAPSHOT_DIR)
+            info = None if manifest is None else manifest['tables'].get(name)
+            if info is not None and (info['source_size'], info['source_mtime']) == signature:
+                _checksums[path] = (signature, info['source_sha256'])
+            else:
+                _checksums[path] = (signature, _sha256(path))
+        return _checksums[path][1]
+
+
+def _manifest(directory):
+    with _lock:
+        if directory not in _manifests:
+            path = os.path.join(directory, 'manifest.json')
+            manifest = None
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') != SNAPSHOT_VERSION:
+                    manifest = None
+            _manifests[directory] = manifest
+        return _manifests[directory]
+
+
+def _snapshot_info(name):
+    manifest = _manifest(SNAPSHOT_DIR)
+    if manifest is None or name not in manifest['tables']:
+        return None
+
+    info = manifest['tables'][name]
+
+    # csv文件被修改后快照即过期（文件大小不变但修改时间更新时，再比较校验和）
+    source = os.path.join(DATA_DIR, info['source'])
+    if os.path.exists(source) and (
+            os.path.getsize(source) != info['source_size'] or
+            (os.path.getmtime(source) > info['source_mtime'] and _sha256(source) != info['source_sha256'])):
+        warnings.warn(f"The snapshot of {name} is out of date, reading {info['source']} instead. "
+                      f"Run herbiv.dataset.compile_snapshot() to update it.")
+        return None
+
+    return info
+
+
+def _snapshot_index(by):
+    # 快照中的索引仅在编码表所依赖的数据集均读取自快照时可用
+    manifest = _manifest(SNAPSHOT_DIR)
+    key = f'score_index.{by}'
+    if manifest is None or key not in manifest.get('indexes', {}) or \
+            any(_snapshot_info(name) is None for name in NAMESPACES['HVCID'] + NAMESPACES['Ensembl_ID']):
+        return None
+
+    return {file.split('.')[-2]: _load_array(os.path.join(SNAPSHOT_DIR, 'index', file))
+            for file in manifest['indexes'][key]['files']}
+
+
+def _write_column(series, table_dir, stem):
+    col = {'name': series.name, 'dtype': str(series.dtype), 'files': {}}
+
+    if series.dtype.kind in 'biufc':
+        # 数值列直接保存为.npy文件
+        col['kind'] = 'numeric'
+        files = {stem + '.npy': series.to_numpy()}
+    else:
+        # 文本列按字典编码保存：各不同值的UTF-8字节串、各值在解码后字符串中的偏移量及各行的编码（缺失值为-1）
+        col['kind'] = 'string'
+        codes, uniques = pd.factorize(series)
+        values = [str(v) for v in uniques]
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in values], out=offsets[1:])
+        files = {
+            stem + '.data.npy': np.frombuffer(''.join(values).encode('utf-8'), dtype=np.uint8),
+            stem + '.offsets.npy': offsets,
+            stem + '.codes.npy': codes.astype(np.int32),
+        }
+
+    for file, array in files.items():
+        path = os.path.join(table_dir, file)
+        np.save(path, array, allow_pickle=False)
+        col['files'][file] = _sha256(path)
+
+    return col
+
+
+def _read_column(col, table_dir):
+    arrays = [_load_array(os.path.join(table_dir, file)) for file in col['files']]
+
+    if col['kind'] == 'numeric':
+        return pd.Series(arrays[0], dtype=col['dtype'], copy=False)
+
+    data, offsets, codes = arrays
+    text = data.tobytes().decode('utf-8')
+    uniques = pd.array([text[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())], dtype=col['dtype'])
+
+    return pd.Series(uniques.take(np.asarray(codes, dtype=np.intp), allow_fill=True), dtype=col['dtype'])
+
+
+def _load_array(path):
+    # 以内存映射的方式读取.npy文件，多个进程可共享操作系统的页缓存（空数组无法映射）
+    try:
+        return np.load(path, mmap_mode='r', allow_pickle=False)
+    except ValueError:
+        return np.load(path, allow_pickle=False)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+if __name__ == '__main__':
+    compile_snapshot()
@@ -1,9 +1,13 @@
+import numpy as np
 import pandas as pd
-import os
+from herbiv import dataset
+from herbiv import graph
+from herbiv import instrument
 
 
 # TODO: 为各函数增加抛出异常功能，若无法查询到相关信息，则抛出异常。
 
+@instrument.staged('get.get_formula')
 def get_formula(by, items) -> pd.DataFrame:
     """
         读取HerbiV_formula数据集，返回items中复方的信息。
@@ -22,11 +26,8 @@ def get_formula(by, items) -> pd.DataFrame:
             0  HVP1625  ...   shang han lun
             [1 rows x 6 columns]
     """
-    # 读取HerbiV_formula数据集
-    formula_all = pd.read_csv(os.path.dirname(os.path.abspath(__file__)) + r'/data/HerbiV_formula.csv')
-
-    # 在数据集中获取items中复方的信息
-    formula = formula_all.loc[formula_all[by].isin(items)].copy()
+    # 在HerbiV_formula数据集中获取items中复方的信息
+    formula = _select('formula', by, items)
 
     # 重新设置索引
     formula.index = range(formula.shape[0])
@@ -34,6 +35,7 @@ def get_formula(by, items) -> pd.DataFrame:
     return formula
 
 
+@instrument.staged('get.get_formula_tcm_links')
 def get_formula_tcm_links(by, items) -> pd.DataFrame:
     """
         读取HerbiV_formula_tcm_links数据集，返回items中复方/中药的复方-中药连接信息。
@@ -59,12 +61,8 @@ def get_formula_tcm_links(by, items) -> pd.DataFrame:
             5  HVP1625  HVM4463
     """
 
-    # 读取HerbiV_formula_tcm_links数据集
-    formula_tcm_links_all = pd.read_csv(os.path.dirname(os.path.abspath(__file__)) +
-                                        r'/data/HerbiV_formula_tcm_links.csv')
-
-    # 在数据集中获取items中复方/中药的复方-中药连接信息
-    formula_tcm_links = formula_tcm_links_all.loc[formula_tcm_links_all[by].isin(items)].copy()
+    # 在HerbiV_formula_tcm_links数据集中获取items中复方/中药的复方-中药连接信息
+    formula_tcm_links = _select_links('formula_tcm_links', by, items)
 
     # 重新设置索引
     formula_tcm_links.index = range(formula_tcm_links.shape[0])
@@ -72,6 +70,7 @@ def get_formula_tcm_links(by, items) -> pd.DataFrame:
     return formula_tcm_links
 
 
+@instrument.staged('get.get_tcm')
 def get_tcm(by, items) -> pd.DataFrame:
     """
         读取HerbiV_tcm数据集，返回items中中药的信息。
@@ -92,11 +91,8 @@ def get_tcm(by, items) -> pd.DataFrame:
             [2 rows x 19 columns]
     """
 
-    # 读取HerbiV_tcm数据集
-    tcm_all = pd.read_csv(os.path.dirname(os.path.abspath(__file__)) + r'/data/HerbiV_tcm.csv')
-
-    # 在数据集中获取items中中药的信息
-    tcm = tcm_all.loc[tcm_all[by].isin(items)].copy()
+    # 在HerbiV_tcm数据集中获取items中中药的信息
+    tcm = _select('tcm', by, items)
 
     # 重新设置索引
     tcm.index = range(tcm.shape[0])
@@ -104,6 +100,7 @@ def get_tcm(by, items) -> pd.DataFrame:
     return tcm
 
 
+@instrument.staged('get.get_tcm_chem_links')
 def get_tcm_chem_links(by, items) -> pd.DataFrame:
     """
         读取HerbiV_tcm_chemical_links数据集，返回items中中药/化合物的中药-成分（化合物）连接信息。
@@ -134,12 +131,8 @@ def get_tcm_chem_links(by, items) -> pd.DataFrame:
             [316 rows x 2 columns]
     """
 
-    # 读取HerbiV_tcm_chemical_links数据集
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    tcm_chem_links_all = pd.read_csv(current_directory + r'/data/HerbiV_tcm_chemical_links.csv')
-
-    # 在数据集中获取items中中药/化合物的中药-成分连接信息
-    tcm_chem_links = tcm_chem_links_all.loc[tcm_chem_links_all[by].isin(items)].copy()
+    # 在HerbiV_tcm_chemical_links数据集中获取items中中药/化合物的中药-成分连接信息
+    tcm_chem_links = _select_links('tcm_chem_links', by, items)
 
     # 重新设置索引
     tcm_chem_links.index = range(tcm_chem_links.shape[0])
@@ -147,6 +140,7 @@ def get_tcm_chem_links(by, items) -> pd.DataFrame:
     return tcm_chem_links
 
 
+@instrument.staged('get.get_chemicals')
 def get_chemicals(by, items) -> pd.DataFrame:
     """
         读取HerbiV_chemicals数据集，返回items中化合物的信息。
@@ -177,12 +171,8 @@ def get_chemicals(by, items) -> pd.DataFrame:
             [258 rows x 8 columns]
     """
 
-    # 读取HerbiV_chemical_protein_links数据集
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    chem_all = pd.read_csv(current_directory + r'/data/HerbiV_chemicals.csv')
-
-    # 在数据集中获取items中化合物的信息
-    chem = chem_all.loc[chem_all[by].isin(items)].drop_duplicates(subset=['HVCID'])
+    # 在HerbiV_chemicals数据集中获取items中化合物的信息
+    chem = _select('chemicals', by, items).drop_duplicates(subset=['HVCID'])
 
     # 重新设置索引
     chem.index = range(chem.shape[0])
@@ -190,6 +180,7 @@ def get_chemicals(by, items) -> pd.DataFrame:
     return chem
 
 
+@instrument.staged('get.get_chem_protein_links')
 def get_chem_protein_links(by, items, score=900) -> pd.DataFrame:
     """
         读取HerbiV_chemical_protein_links数据集，
@@ -217,19 +208,28 @@ def get_chem_protein_links(by, items, score=900) -> pd.DataFrame:
             1  HVC0159  ENSP00000335062           0.795
     """
 
-    # 读取HerbiV_chemical_protein_links数据集
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    chem_protein_links_all = pd.read_csv(current_directory + r'/data/HerbiV_chemical_protein_links.csv')
-
-    # 在数据集中获取items中化合物/蛋白的化合物-靶点（蛋白）连接的combined_score大于等于score的连接信息
-    chem_protein_links = chem_protein_links_all.loc[
-        (chem_protein_links_all[by].isin(items)) &
-        (chem_protein_links_all['Combined_score'] >= score)].copy()
-
-    # 将Combined_score变换为0-1的浮点数
-    chem_protein_links['Combined_score'] = chem_protein_links['Combined_score'].astype(float)
-    chem_protein_links.loc[:, 'Combined_score'] = chem_protein_links.loc[:, 'Combined_score'].apply(
-        lambda x: x / 1000)
+    if by in dataset.LINKS['chem_protein_links']:
+        # 在按化合物/蛋白分组、组内按combined_score排序的邻接数组中二分查找items中化合物/蛋白的combined_score大于等于score的连接
+        other = 'Ensembl_ID' if by == 'HVCID' else 'HVCID'
+        adj = graph.adjacency(by, other)
+        positions = graph.edges(by, np.unique(_encode(by, items)), other, score)
+
+        # 按在数据集中的顺序排列
+        order = np.argsort(adj['rows'][positions], kind='stable')
+        rows, scores = adj['rows'][positions][order], adj['score'][positions][order]
+
+        links = dataset.links('chem_protein_links')
+        chem_protein_links = pd.DataFrame({'HVCID': dataset.decode('HVCID', links['HVCID'][rows]),
+                                           'Ensembl_ID': dataset.decode('Ensembl_ID', links['Ensembl_ID'][rows]),
+                                           # Combined_score在索引中已变换为0-1的float32格式，在此还原为三位小数的float64
+                                           'Combined_score': np.round(scores.astype(np.float64), 3)})
+    else:
+        # 在数据集中获取items中化合物/蛋白的化合物-靶点（蛋白）连接的combined_score大于等于score的连接信息
+        chem_protein_links = _select_links('chem_protein_links', by, items,
+                                           dataset.links('chem_protein_links')['Combined_score'] >= score)
+
+        # 将Combined_score变换为0-1的浮点数
+        chem_protein_links['Combined_score'] = chem_protein_links['Combined_score'].astype(float) / 1000
 
     # 重新设置索引
     chem_protein_links.index = range(chem_protein_links.shape[0])
@@ -237,6 +237,7 @@ def get_chem_protein_links(by, items, score=900) -> pd.DataFrame:
     return chem_protein_links
 
 
+@instrument.staged('get.get_proteins')
 def get_proteins(by, items) -> pd.DataFrame:
     """
         读取HerbiV_proteins数据集，返回items中蛋白的信息。
@@ -255,14 +256,49 @@ def get_proteins(by, items) -> pd.DataFrame:
             0  ENSP00000335062  ...  PDCD1 PD1
     """
 
-    # 读取HerbiV_proteins数据集
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    proteins_all = pd.read_csv(current_directory + r'/data/HerbiV_proteins.csv')
-
-    # 在数据集中获取items中蛋白的信息
-    proteins = proteins_all.loc[proteins_all[by].isin(items)].drop_duplicates(subset=['Ensembl_ID'])
+    # 在HerbiV_proteins数据集中获取items中蛋白的信息
+    proteins = _select('proteins', by, items).drop_duplicates(subset=['Ensembl_ID'])
 
     # 重置索引
     proteins.index = range(proteins.shape[0])
 
     return proteins
+
+
+def _select(name, by, items) -> pd.DataFrame:
+    # 在数据集中获取by列的值在items中的行，by为ID列时使用整数编码进行匹配
+    table = dataset.load(name)
+
+    if by in dataset.NAMESPACES:
+        return table.iloc[np.flatnonzero(np.isin(dataset.codes(name, by), _encode(by, items)))].copy()
+
+    return table.loc[table[by].isin(items)].copy()
+
+
+def _select_links(name, by, items, mask=None) -> pd.DataFrame:
+    # 在以整数数组存储的连接数据集中获取by列的值在items中（且满足mask）的行，仅将这些行的编码还原为ID
+    links = dataset.links(name)
+
+    if by in dataset.NAMESPACES:
+        matched = np.isin(links[by], _encode(by, items))
+    else:
+        matched = pd.Series(links[by]).isin(items).to_numpy()
+
+    if mask is not None:
+        matched = matched & mask
+
+    return _links_at(name, np.flatnonzero(matched))
+
+
+def _links_at(name, rows) -> pd.DataFrame:
+    # 连接数据集中行号为rows的各行，仅将这些行的编码还原为ID
+    links = dataset.links(name)
+    return pd.DataFrame({col: dataset.decode(col, values[rows]) if col in dataset.NAMESPACES else values[rows]
+                         for col, values in links.items()})
+
+
+def _encode(namespace, items) -> np.ndarray:
+    # 将items编码为整数，忽略不在数据集中的ID
+    codes = dataset.encode(namespace, items)
+    return codes[codes >= 0]
+
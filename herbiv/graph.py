@@ -0,0 +1,196 @@
+import numpy as np
+from herbiv import dataset
+
+# 网络中的四层节点（ID命名空间），按复方→中药→化合物→蛋白的顺序排列
+LAYERS = ('HVPID', 'HVMID', 'HVCID', 'Ensembl_ID')
+
+
+def adjacency(source, target) -> dict:
+    """
+        返回网络中相邻两层之间（正向或反向）的CSR格式的邻接数组，首次使用时由连接数据集生成并常驻内存。
+        Return the adjacency arrays in CSR format between two adjacent layers (forward or reverse) of the network,
+        which are built from the link datasets on first use and kept resident.
+
+        Args:
+            source (str): 起始层的ID命名空间，如'HVMID'。ID namespace of the source layer, e.g. 'HVMID'.
+            target (str): 目标层的ID命名空间，须与source相邻，如'HVCID'。
+            ID namespace of the target layer, which should be adjacent to source, e.g. 'HVCID'.
+
+        Returns:
+            dict: 'indptr'：编码为i的节点的邻居为indices[indptr[i]:indptr[i + 1]]；'indices'：邻居的编码；
+            'rows'：各条边在连接数据集中的行号；'score'：各条边变换为0-1的Combined_score（组内升序排列），
+            仅化合物与蛋白之间存在，其余为None。
+            'indptr': neighbours of the node coded i are indices[indptr[i]:indptr[i + 1]];
+            'indices': codes of the neighbours; 'rows': row numbers of the edges in the link dataset;
+            'score': Combined_score of the edges scaled to 0-1 (ascending within each node),
+            only between chemicals and proteins, None otherwise.
+
+        Examples:
+            >>> chai_hu = dataset.encode('HVMID', ['HVM0367'])[0]# 柴胡的编码
+            >>> adj = adjacency('HVMID', 'HVCID')
+            >>> dataset.decode('HVCID', adj['indices'][adj['indptr'][chai_hu]:adj['indptr'][chai_hu + 1]])
+            Index(['HVC0034', 'HVC0036', 'HVC0036', ..., 'HVC6204'], dtype='str', length=316)
+    """
+
+    name = _link_name(source, target)
+
+    def build():
+        links = dataset.links(name)
+
+        # 化合物与蛋白之间的边直接使用按Combined_score排序的索引
+        if name == 'chem_protein_links':
+            index = dataset.score_index(source)
+            return {'indptr': index['indptr'], 'indices': links[target][index['rows']],
+                    'rows': index['rows'], 'score': index['score']}
+
+        src, dst = links[source], links[target]
+        rows = np.flatnonzero((src >= 0) & (dst >= 0))
+        rows = rows[np.lexsort((dst[rows], src[rows]))]
+        indptr = np.zeros(len(dataset.vocabulary(source)) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src[rows], minlength=len(indptr) - 1), out=indptr[1:])
+
+        return {'indptr': indptr, 'indices': dst[rows], 'rows': rows.astype(np.int64), 'score': None}
+
+    return dataset.derive(('adjacency', source, target),
+                          dataset.NAMESPACES[source] + dataset.NAMESPACES[target], build)
+
+
+def edges(source, codes, target, score=0) -> np.ndarray:
+    """
+        返回codes中的节点指向target层的边在adjacency(source, target)中的位置，耗时仅与这些节点的度数有关。
+        Return the positions in adjacency(source, target) of the edges from the nodes in codes to the target layer,
+        at a cost proportional to the degrees of these nodes only.
+
+        Args:
+            source (str): 起始层的ID命名空间。ID namespace of the source layer.
+            codes (numpy.ndarray): 起始节点的编码。Codes of the source nodes.
+            target (str): 目标层的ID命名空间。ID namespace of the target layer.
+            score (int): 化合物与蛋白之间仅combined_score大于等于score的边会被筛选出，默认为0，最大为1000。
+            Only edges between chemicals and proteins with combined_score no less than score are kept, 0 by default.
+
+        Returns:
+            numpy.ndarray: 各条边的位置，可用于索引adjacency(source, target)中的'indices'、'rows'和'score'。
+            Positions of the edges, which index 'indices', 'rows' and 'score' of adjacency(source, target).
+    """
+
+    adj = adjacency(source, target)
+    codes = np.asarray(codes, dtype=np.int64)
+    codes = codes[codes >= 0]
+
+    if adj['score'] is None:
+        starts = adj['indptr'][codes]
+    else:
+        starts = search(adj, codes, np.float32(score / 1000))
+
+    return ranges(starts, adj['indptr'][codes + 1])
+
+
+def neighbors(source, codes, target, score=0) -> np.ndarray:
+    """
+        返回codes中的节点在相邻的target层中的邻居。
+        Return the neighbours in the adjacent target layer of the nodes in codes.
+
+        Args:
+            source (str): 起始层的ID命名空间。ID namespace of the source layer.
+            codes (numpy.ndarray): 起始节点的编码。Codes of the source nodes.
+            target (str): 目标层的ID命名空间。ID namespace of the target layer.
+            score (int): 化合物与蛋白之间仅combined_score大于等于score的边会被使用，默认为0。
+            Only edges between chemicals and proteins with combined_score no less than score are used, 0 by default.
+
+        Returns:
+            numpy.ndarray: 邻居的编码（升序排列且不重复）。Codes of the neighbours (unique and sorted).
+
+        Examples:
+            >>> # 获取柴胡和黄芩的成分
+            >>> dataset.decode('HVCID', neighbors('HVMID', dataset.encode('HVMID', ['HVM0367', 'HVM1695']), 'HVCID'))
+    """
+
+    indices = adjacency(source, target)['indices'][edges(source, codes, target, score)]
+    return np.unique(indices[indices >= 0])
+
+
+def expand(source, codes, target, score=0) -> dict:
+    """
+        沿复方→中药→化合物→蛋白（或其反方向）逐层扩展，返回从codes中的节点出发可到达的各层节点。
+        Expand layer by layer along formula→TCM→chemical→protein (or the reverse direction)
+        and return the nodes of each layer reachable from the nodes in codes.
+
+        Args:
+            source (str): 起始层的ID命名空间。ID namespace of the source layer.
+            codes (numpy.ndarray): 起始节点的编码。Codes of the source nodes.
+            target (str): 扩展终止的层的ID命名空间。ID namespace of the layer where the expansion stops.
+            score (int): 化合物与蛋白之间仅combined_score大于等于score的边会被使用，默认为0。
+            Only edges between chemicals and proteins with combined_score no less than score are used, 0 by default.
+
+        Returns:
+            dict: 以ID命名空间为键的各层可到达的节点的编码（含起始层）。
+            Codes of the reachable nodes of each layer (including the source layer) keyed by ID namespace.
+
+        Examples:
+            >>> # 获取小柴胡汤中的中药、化合物及其combined_score不低于990的靶点
+            >>> reached = expand('HVPID', dataset.encode('HVPID', ['HVP1625']), 'Ensembl_ID', score=990)
+            >>> dataset.decode('Ensembl_ID', reached['Ensembl_ID'])
+    """
+
+    i, j = LAYERS.index(source), LAYERS.index(target)
+    step = 1 if j >= i else -1
+
+    codes = np.asarray(codes, dtype=np.int64)
+    reached = {source: np.unique(codes[codes >= 0])}
+    for k in range(i, j, step):
+        reached[LAYERS[k + step]] = neighbors(LAYERS[k], reached[LAYERS[k]], LAYERS[k + step], score)
+
+    return reached
+
+
+def search(adj, codes, threshold) -> np.ndarray:
+    """
+        在codes中各节点的邻居（按score升序排列）中同时进行二分查找，返回各节点第一条score不低于threshold的边的位置。
+        Binary search the neighbours (sorted by ascending score) of all nodes in codes at once
+        and return the position of the first edge of each node whose score is no less than threshold.
+
+        Args:
+            adj (dict): adjacency的返回值。Return value of adjacency.
+            codes (numpy.ndarray): 节点的编码。Codes of the nodes.
+            threshold (numpy.float32): 0-1的阈值。Threshold between 0 and 1.
+
+        Returns:
+            numpy.ndarray: 各节点第一条不低于阈值的边的位置（没有时为该节点最后一条边之后的位置）。
+            Position of the first edge no less than the threshold of each node (one past its last edge if none).
+    """
+
+    lo = adj['indptr'][codes].copy()
+    hi = adj['indptr'][codes + 1].copy()
+    score = adj['score']
+
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        below = active & (score[np.where(active, mid, 0)] < threshold)
+        lo = np.where(below, mid + 1, lo)
+        hi = np.where(active & ~below, mid, hi)
+
+
+def ranges(starts, ends) -> np.ndarray:
+    """
+        将各区间[starts[i], ends[i])中的整数连接为一个数组。
+        Concatenate the integers in the ranges [starts[i], ends[i]) into one array.
+
+        Examples:
+            >>> ranges(np.array([0, 5]), np.array([2, 8]))
+            array([0, 1, 5, 6, 7])
+    """
+
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum(), dtype=np.int64)
+
+
+def _link_name(source, target):
+    # 相邻两层之间的连接数据集
+    for name, (a, b) in dataset.LINKS.items():
+        if {a, b} == {source, target}:
+            return name
+    raise ValueError(f"{source} and {target} are not adjacent layers of the network.")
@@ -0,0 +1,280 @@
+import json
+import time
+import warnings
+import functools
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+
+# 全局回调：每个阶段结束时以该阶段的记录（Stage）调用，无论是否在profile中
+_callbacks = []
+
+# 当前上下文中正在进行的profile（Stats）
+_active = contextvars.ContextVar('herbiv_profile', default=None)
+
+
+class Stage:
+    """
+        分析流程中一个阶段的记录。
+        Record of one stage of the analysis pipeline.
+
+        Attributes:
+            name (str): 阶段的名称，如'get.get_tcm'、'compute.score'。Name of the stage.
+            start (float): 开始时间（相对于profile开始的秒数）。Start time in seconds since the profile started.
+            seconds (float): 耗时（秒）。Wall time in seconds.
+            peak_memory (int): 该阶段中Python分配的内存的峰值相对于开始时的增量（字节），未记录内存时为None。
+            Peak memory allocated during the stage above its start in bytes, None if memory is not traced.
+            rows_in (int): 输入的行数（各表的行数或ID的个数之和），无法统计时为None。Number of input rows, None if unknown.
+            rows_out (int): 输出的行数，无法统计时为None。Number of output rows, None if unknown.
+            depth (int): 嵌套的层数，最外层为0。Nesting depth, 0 for outermost stages.
+            error (str): 阶段中抛出的异常的类型，未抛出异常时为None。Type of the exception raised in the stage, if any.
+    """
+
+    def __init__(self, name, rows_in=None, depth=0, start=0.0):
+        self.name = name
+        self.start = start
+        self.seconds = None
+        self.peak_memory = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.depth = depth
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'start': self.start, 'seconds': self.seconds, 'peak_memory': self.peak_memory,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out, 'depth': self.depth, 'error': self.error}
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, seconds={self.seconds}, peak_memory={self.peak_memory}, ' \
+               f'rows_in={self.rows_in}, rows_out={self.rows_out})'
+
+
+class Stats:
+    """
+        profile中记录的各阶段，按开始的先后排列。
+        Stages recorded in a profile, in the order they started.
+
+        Examples:
+            >>> with profile() as stats:
+            ...     analysis.from_proteins(['ENSP00000381588', 'ENSP00000252519'], random_state=1, num=100)
+            >>> stats.summary()['compute.score']
+            {'calls': 1, 'seconds': 0.08, 'peak_memory': 2719744, 'rows_in': 17469, 'rows_out': 5378}
+            >>> print(stats.to_json())
+    """
+
+    def __init__(self, memory=True, callbacks=None):
+        self.memory = memory
+        self.callbacks = list(callbacks or [])
+        self.stages = []
+        self.seconds = None
+        self.peak_memory = None
+        self._started = time.perf_counter()
+        # 正在进行的阶段及其内存峰值（绝对值）、开始时已分配的内存
+        self._stack = []
+
+    def summary(self) -> dict:
+        """
+            按阶段的名称汇总调用次数、总耗时、最大的内存峰值及行数之和。
+        """
+
+        result = {}
+        for stage in self.stages:
+            item = result.setdefault(stage.name, {'calls': 0, 'seconds': 0.0, 'peak_memory': None,
+                                                  'rows_in': None, 'rows_out': None})
+            item['calls'] += 1
+            item['seconds'] += stage.seconds or 0.0
+            if stage.peak_memory is not None:
+                item['peak_memory'] = max(item['peak_memory'] or 0, stage.peak_memory)
+            for field in ('rows_in', 'rows_out'):
+                if getattr(stage, field) is not None:
+                    item[field] = (item[field] or 0) + getattr(stage, field)
+        return result
+
+    def to_dict(self) -> dict:
+        return {'seconds': self.seconds, 'peak_memory': self.peak_memory,
+                'stages': [stage.to_dict() for stage in self.stages], 'summary': self.summary()}
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, **kwargs)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __repr__(self):
+        lines = [f'{"stage":<40}{"seconds":>10}{"peak MiB":>10}{"rows in":>10}{"rows out":>10}']
+        for stage in self.stages:
+            memory = '' if stage.peak_memory is None else f'{stage.peak_memory / 1024 ** 2:.1f}'
+            lines.append(f'{"  " * stage.depth + stage.name:<40}{stage.seconds or 0:>10.3f}{memory:>10}'
+                         f'{"" if stage.rows_in is None else stage.rows_in:>10}'
+                         f'{"" if stage.rows_out is None else stage.rows_out:>10}')
+        return '\n'.join(lines)
+
+    def _enter(self, stage):
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # 记录外层阶段在此之前的峰值，再重新开始统计峰值
+            for item in self._stack:
+                item[1] = max(item[1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([stage, current, current])
+        else:
+            self._stack.append([stage, None, None])
+
+    def _exit(self, stage):
+        item = self._stack.pop()
+        if item[1] is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            for outer in self._stack:
+                outer[1] = max(outer[1], peak)
+            tracemalloc.reset_peak()
+            stage.peak_memory = max(item[1], peak) - item[2]
+
+
+@contextmanager
+def profile(memory=True, callbacks=None):
+    """
+        在with语句中记录分析流程中各阶段的耗时、内存峰值及输入和输出的行数。
+        Record the wall time, peak memory and input/output row counts of each pipeline stage within a with statement.
+
+        Args:
+            memory (bool): 是否使用tracemalloc记录内存峰值（会使计算变慢），默认为True。
+            Whether to trace peak memory with tracemalloc (which slows computation down), True by default.
+            callbacks (list): 每个阶段结束时以该阶段的记录（Stage）调用的函数。Functions called with each finished Stage.
+
+        Returns:
+            Stats: 记录的各阶段（在with语句结束后完整）。The recorded stages (complete after the with statement).
+
+        Examples:
+            >>> with profile() as stats:
+            ...     analysis.from_tcm_or_formula(['HVP1625'], out_for_cytoscape=False, out_graph=False)
+            >>> print(stats)
+    """
+
+    stats = Stats(memory, callbacks)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _active.set(stats)
+    try:
+        with stage('total'):
+            yield stats
+    finally:
+        _active.reset(token)
+        stats.seconds = stats.stages[0].seconds
+        stats.peak_memory = stats.stages[0].peak_memory
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+        记录一个阶段。不在profile中且没有全局回调时仅计时，开销可忽略。
+        Record a stage. Outside a profile and without global callbacks it only measures time, at negligible cost.
+
+        Args:
+            name (str): 阶段的名称。Name of the stage.
+            rows_in (int): 输入的行数。Number of input rows.
+
+        Returns:
+            Stage: 阶段的记录，可在with语句中设置rows_out。The Stage, whose rows_out can be set within the with statement.
+
+        Examples:
+            >>> with stage('load', rows_in=2) as s:
+            ...     table = get.get_tcm('HVMID', ['HVM0367', 'HVM1695'])
+            ...     s.rows_out = len(table)
+    """
+
+    stats = _active.get()
+    record = Stage(name, rows_in, len(stats._stack) if stats is not None else 0,
+                   time.perf_counter() - stats._started if stats is not None else 0.0)
+    if stats is not None:
+        stats.stages.append(record)
+        stats._enter(record)
+
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.seconds = time.perf_counter() - start
+        if stats is not None:
+            stats._exit(record)
+        for callback in _callbacks + (stats.callbacks if stats is not None else []):
+            try:
+                callback(record)
+            except Exception as e:
+                warnings.warn(f'Instrumentation callback {callback!r} failed: {e!r}')
+
+
+def staged(name):
+    """
+        将函数的每次调用记录为一个阶段，输入和输出的行数为参数和返回值中各表的行数（或ID的个数）之和。
+        Record each call of the function as a stage, counting rows of the tables (or IDs) in its arguments and result.
+
+        Args:
+            name (str): 阶段的名称。Name of the stage.
+
+        Examples:
+            >>> @staged('compute.score')
+            ... def score(tcm, tcm_chem_links, chem, chem_protein_links): ...
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active.get() is None and not _callbacks:
+                return function(*args, **kwargs)
+            with stage(name, _rows(list(args) + list(kwargs.values()))) as record:
+                result = function(*args, **kwargs)
+                record.rows_out = _rows(result if isinstance(result, (tuple, list)) else [result])
+                return result
+        return wrapper
+    return decorator
+
+
+def add_callback(callback):
+    """
+        添加全局回调，每个阶段结束时以该阶段的记录（Stage）调用，可用于将各阶段的耗时发送至监控系统。
+        Add a global callback, called with each finished Stage (e.g. to send stage timings to a monitoring system).
+
+        Args:
+            callback (collections.abc.Callable): 以Stage为参数的函数。Function taking a Stage.
+    """
+
+    _callbacks.append(callback)
+
+
+def remove_callback(callback):
+    """
+        删除全局回调。
+        Remove a global callback.
+
+        Args:
+            callback (collections.abc.Callable): add_callback添加的函数。Function added by add_callback.
+    """
+
+    _callbacks.remove(callback)
+
+
+def _rows(values):
+    # 各表（有shape属性的对象）的行数及ID列表的长度之和，均无法统计时为None
+    total = None
+    for value in values:
+        if getattr(value, 'ndim', 0) >= 1:
+            n = len(value)
+        elif isinstance(value, (list, tuple)) and value and \
+                all(item is None or getattr(item, 'ndim', 0) >= 1 for item in value):
+            # 多个表（如analysis返回的各表）
+            n = _rows(value) or 0
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            n = len(value)
+        else:
+            continue
+        total = (total or 0) + n
+    return total
@@ -1,7 +1,10 @@
 import os
+import numpy as np
 import pandas as pd
-from pyecharts import options as opts
-from pyecharts.charts import Graph
+from herbiv import instrument
+
+# vis支持的布局
+LAYOUTS = ('circular', 'layered', 'force')
 
 
 def re_name(tcm, tcm_chem_links, chem, chem_protein_links, protein):
@@ -19,35 +22,18 @@ def re_name(tcm, tcm_chem_links, chem, chem_protein_links, protein):
     chem_protein_links_c = chem_protein_links.copy()
     protein_c = protein.copy()
 
+    # 以ID到名称的映射（同一ID取第一个名称）替换各连接两端的ID，找不到名称的连接整体删除
     out_chem_protein_links = chem_protein_links_c.iloc[:, 0:2]
     out_chem_protein_links.columns = ['SourceNode', 'TargetNode']
-
-    out_chem_protein_links.loc[:, 'SourceNode'] = out_chem_protein_links.loc[:, 'SourceNode'].apply(
-        lambda x: chem_c.loc[chem_c['HVCID'] == x]['Name'].iloc[0] if len(
-            chem_c.loc[chem_c['HVCID'] == x]['Name']) > 0 else None)
-
-    out_chem_protein_links.dropna(subset=['SourceNode'], inplace=True)
-
-    out_chem_protein_links.loc[:, 'TargetNode'] = out_chem_protein_links.loc[:, 'TargetNode'].apply(
-        lambda x: protein_c.loc[protein_c['Ensembl_ID'] == x]['gene_name'].iloc[0] if len(
-            protein_c.loc[protein_c['Ensembl_ID'] == x]['gene_name']) > 0 else None)
-
-    out_chem_protein_links.dropna(subset=['TargetNode'], inplace=True)
+    out_chem_protein_links = _re_name_links(out_chem_protein_links,
+                                            _name_map(chem_c, 'HVCID', 'Name'),
+                                            _name_map(protein_c, 'Ensembl_ID', 'gene_name'))
 
     out_tcm_chem = tcm_chem_links_c.iloc[:, 0:2]
     out_tcm_chem.columns = ['SourceNode', 'TargetNode']
-
-    out_tcm_chem.loc[:, 'SourceNode'] = out_tcm_chem.loc[:, 'SourceNode'].apply(
-        lambda x: tcm_c.loc[tcm_c['HVMID'] == x]['cn_name'].iloc[0] if len(
-            tcm_c.loc[tcm_c['HVMID'] == x]['cn_name']) > 0 else None)
-
-    out_tcm_chem.dropna(subset=['SourceNode'], inplace=True)
-
-    out_tcm_chem.loc[:, 'TargetNode'] = out_tcm_chem.loc[:, 'TargetNode'].apply(
-        lambda x: chem_c.loc[chem_c['HVCID'] == x]['Name'].iloc[0] if len(
-            chem_c.loc[chem_c['HVCID'] == x]['Name']) > 0 else None)
-
-    out_tcm_chem.dropna(subset=['TargetNode'], inplace=True)
+    out_tcm_chem = _re_name_links(out_tcm_chem,
+                                  _name_map(tcm_c, 'HVMID', 'cn_name'),
+                                  _name_map(chem_c, 'HVCID', 'Name'))
 
     out_chem = chem_c.loc[:, ['Name']]
     out_chem.columns = ['Key']
@@ -64,7 +50,80 @@ def re_name(tcm, tcm_chem_links, chem, chem_protein_links, protein):
     return out_tcm, out_tcm_chem, out_chem, out_chem_protein_links, out_gene
 
 
-def out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result'):
+def _name_map(info, by, name):
+    # ID到名称的映射，同一ID出现多次时取第一个
+    info = info.loc[info[by].notna(), [by, name]].drop_duplicates(subset=by, keep='first')
+    return pd.Series(info[name].to_numpy(), index=info[by].to_numpy())
+
+
+def _re_name_links(links, source_names, target_names):
+    # 将连接两端的ID替换为名称，删除任一端找不到名称的连接
+    links = links.copy()
+    links['SourceNode'] = links['SourceNode'].map(source_names)
+    links = links.dropna(subset=['SourceNode'])
+    links['TargetNode'] = links['TargetNode'].map(target_names)
+    return links.dropna(subset=['TargetNode'])
+
+
+def prune(tcm, tcm_chem_links, chem, chem_protein_links, protein, top_k=None, min_score=None):
+    """
+    按重要性裁剪网络，仅保留各层排名靠前的节点及连接它们的完整的中药-化合物-蛋白通路，使输出的规模只与top_k有关
+    :param tcm: pd.DataFrame类型，中药信息（含compute.score计算的Importance Score）
+    :param tcm_chem_links: pd.DataFrame类型，中药-化合物（中药成分）连接信息
+    :param chem: pd.DataFrame类型，化合物（中药成分）信息（含compute.score计算的Importance Score）
+    :param chem_protein_links: pd.DataFrame类型，化合物（中药成分）-蛋白质（靶点）连接信息
+    :param protein: pd.DataFrame类型，蛋白质（靶点）信息
+    :param top_k: 整数类型，各层最多保留的节点数，中药和化合物按Importance Score、蛋白按与其相连的Combined_score的最大值降序选取，
+                  默认为None（不限制）
+    :param min_score: 浮点数类型，仅保留Combined_score（0-1）大于等于min_score的化合物-蛋白连接，默认为None（不限制）
+    :return: 裁剪后的tcm, tcm_chem_links, chem, chem_protein_links, protein
+    """
+    if min_score is not None:
+        chem_protein_links = chem_protein_links.loc[chem_protein_links['Combined_score'] >= min_score]
+
+    # 仅在完整通路中的节点参与排名
+    tcm_chem_links, chem_protein_links = _complete_paths(tcm, tcm_chem_links, chem, chem_protein_links, protein)
+
+    if top_k is not None:
+        # 逐层选取：中药取前top_k个，化合物在与保留的中药相连的化合物中取前top_k个，蛋白同理
+        tcm_id = _top(tcm.loc[tcm['HVMID'].isin(tcm_chem_links['HVMID'])], 'HVMID', 'Importance Score', top_k)
+        tcm_chem_links = tcm_chem_links.loc[tcm_chem_links['HVMID'].isin(tcm_id)]
+
+        chem_id = _top(chem.loc[chem['HVCID'].isin(tcm_chem_links['HVCID'])], 'HVCID', 'Importance Score', top_k)
+        chem_protein_links = chem_protein_links.loc[chem_protein_links['HVCID'].isin(chem_id)]
+
+        protein_score = chem_protein_links.groupby('Ensembl_ID', sort=False)['Combined_score'].max().reset_index()
+        protein_id = _top(protein_score, 'Ensembl_ID', 'Combined_score', top_k)
+        chem_protein_links = chem_protein_links.loc[chem_protein_links['Ensembl_ID'].isin(protein_id)]
+
+        # 删除因蛋白被裁剪而不再在完整通路中的节点
+        tcm_chem_links = tcm_chem_links.loc[tcm_chem_links['HVCID'].isin(chem_id)]
+        tcm_chem_links, chem_protein_links = _complete_paths(tcm, tcm_chem_links, chem, chem_protein_links, protein)
+
+    tcm = tcm.loc[tcm['HVMID'].isin(tcm_chem_links['HVMID'])]
+    chem = chem.loc[chem['HVCID'].isin(tcm_chem_links['HVCID'])]
+    protein = protein.loc[protein['Ensembl_ID'].isin(chem_protein_links['Ensembl_ID'])]
+
+    return tcm, tcm_chem_links, chem, chem_protein_links, protein
+
+
+def _complete_paths(tcm, tcm_chem_links, chem, chem_protein_links, protein):
+    # 仅保留在完整的中药-化合物-蛋白通路中的连接
+    chem_protein_links = chem_protein_links.loc[chem_protein_links['HVCID'].isin(chem['HVCID']) &
+                                                chem_protein_links['Ensembl_ID'].isin(protein['Ensembl_ID'])]
+    tcm_chem_links = tcm_chem_links.loc[tcm_chem_links['HVMID'].isin(tcm['HVMID']) &
+                                        tcm_chem_links['HVCID'].isin(chem_protein_links['HVCID'])]
+    chem_protein_links = chem_protein_links.loc[chem_protein_links['HVCID'].isin(tcm_chem_links['HVCID'])]
+    return tcm_chem_links, chem_protein_links
+
+
+def _top(info, by, score, k):
+    # score最高的k个节点的ID（score相同时保持原有顺序）
+    return info.sort_values(by=score, ascending=False, kind='stable')[by].head(k)
+
+
+@instrument.staged('output.out_for_cyto')
+def out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result', top_k=None, min_score=None):
     """
     输出Cytoscape用于作图的网络文件和属性文件
     :param protein:
@@ -73,10 +132,15 @@ def out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='r
     :param chem: pd.DataFrame类型，化合物（中药成分）信息
     :param chem_protein_links: pd.DataFrame类型，化合物（中药成分）-蛋白质（靶点）连接信息
     :param path: 字符串类型，存放结果的目录
+    :param top_k: 整数类型，各层最多输出的节点数，见prune，默认为None（输出全部节点）
+    :param min_score: 浮点数类型，仅输出Combined_score大于等于min_score的化合物-蛋白连接，见prune，默认为None
     """
-    # 若无path目录，先创建该目录
-    if not os.path.exists(path):
-        os.mkdir(path)
+    # 若无path目录，先创建该目录（多个进程同时创建时不报错）
+    os.makedirs(path, exist_ok=True)
+
+    if top_k is not None or min_score is not None:
+        tcm, tcm_chem_links, chem, chem_protein_links, protein = \
+            prune(tcm, tcm_chem_links, chem, chem_protein_links, protein, top_k, min_score)
 
     tcm, tcm_chem_links, chem, chem_protein_links, protein = \
         re_name(tcm, tcm_chem_links, chem, chem_protein_links, protein)
@@ -88,7 +152,9 @@ def out_for_cyto(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='r
     pd.concat([tcm, chem, protein]).to_csv(os.path.join(path, "Type.csv"), index=False)
 
 
-def vis(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result'):
+@instrument.staged('output.vis')
+def vis(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result', layout='circular',
+        top_k=None, min_score=None):
     """
     使用pyecharts可视化分析结果
     :param tcm: pd.DataFrame类型，中药信息
@@ -97,54 +163,74 @@ def vis(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result'):
     :param chem_protein_links: pd.DataFrame类型，化合物（中药成分）-蛋白质（靶点）连接信息
     :param protein: pd.DataFrame类型，蛋白质（靶点）连接信息
     :param path: 字符串类型，存放结果的目录
+    :param layout: 字符串类型，网络图的布局，默认为'circular'（由ECharts计算的环形布局）；
+                   'layered'为预先计算的分层布局（中药、化学成分、靶点各占一列），耗时与节点数成线性关系，适用于大型网络；
+                   'force'为预先计算的力导向布局，每次迭代的耗时与节点数的平方成正比。
+                   预先计算的布局直接写入各节点的坐标，浏览器打开时无需再计算布局
+    :param top_k: 整数类型，各层最多显示的节点数，见prune，默认为None（显示全部节点）
+    :param min_score: 浮点数类型，仅显示Combined_score大于等于min_score的化合物-蛋白连接，见prune，默认为None
     """
-    # 若无path目录，先创建该目录
-    if not os.path.exists(path):
-        os.mkdir(path)
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout should be one of {LAYOUTS}, got {layout!r}.")
+
+    # pyecharts仅在绘图时导入
+    from pyecharts import options as opts
+    from pyecharts.charts import Graph
+
+    # 若无path目录，先创建该目录（多个进程同时创建时不报错）
+    os.makedirs(path, exist_ok=True)
+
+    if top_k is not None or min_score is not None:
+        tcm, tcm_chem_links, chem, chem_protein_links, protein = \
+            prune(tcm, tcm_chem_links, chem, chem_protein_links, protein, top_k, min_score)
 
     tcm, tcm_chem_links, chem, chem_protein_links, protein = \
         re_name(tcm, tcm_chem_links, chem, chem_protein_links, protein)
 
-    nodes = []
-    edges = []
-
     categories = [
         {"name": "中药", "color": "#61a0a8"},
         {"name": "化学成分", "color": "#f47920"},
         {"name": "靶点", "color": "#ca8622"},
     ]
 
-    for index, row in tcm_chem_links.iloc[0:].iterrows():
-        chinese_medicine = row[0]
-        chemical_component = row[1]
-        nodes.append({'name': chinese_medicine, "symbolSize": 20, 'category': 0, "color": "#1FA9E9"})
-        nodes.append({'name': chemical_component, "symbolSize": 20, 'category': 1, "color": "#FFFF00"})
-        edges.append({'source': chinese_medicine, 'target': chemical_component})
-
-    for index, row in chem_protein_links.iloc[0:].iterrows():
-        chemical_component = row[0]
-        target = row[1]
-        nodes.append({'name': chemical_component, "symbolSize": 20, 'category': 1, "color": "#FFFF00"})
-        nodes.append({'name': target, "symbolSize": 20, 'category': 2, "color": "#000000"})
-        edges.append({'source': chemical_component, 'target': target})
-
-    unique_list = list(set(tuple(item.items()) for item in nodes))
-    nodes = [dict(item) for item in unique_list]
-
-    unique_list = list(set(tuple(item.items()) for item in nodes))
-    nodes = [dict(item) for item in unique_list]
-
-    Graph(init_opts=opts.InitOpts(width="2400px", height="1200px")) \
+    # 节点：各连接两端的名称及其类别（0：中药，1：化学成分，2：靶点），按名称和类别去重
+    nodes = pd.concat([
+        pd.DataFrame({'name': tcm_chem_links.iloc[:, 0], 'category': 0}),
+        pd.DataFrame({'name': tcm_chem_links.iloc[:, 1], 'category': 1}),
+        pd.DataFrame({'name': chem_protein_links.iloc[:, 0], 'category': 1}),
+        pd.DataFrame({'name': chem_protein_links.iloc[:, 1], 'category': 2}),
+    ]).drop_duplicates()
+    nodes['symbolSize'] = 20
+    nodes['color'] = np.array(["#1FA9E9", "#FFFF00", "#000000"])[nodes['category'].to_numpy()]
+
+    links = pd.concat([tcm_chem_links.iloc[:, 0:2].set_axis(['source', 'target'], axis=1),
+                       chem_protein_links.iloc[:, 0:2].set_axis(['source', 'target'], axis=1)])
+
+    options = {'layout': layout, 'repulsion': 8000}
+    if layout != 'circular':
+        # 节点的坐标，连接两端以其名称对应的第一个节点计
+        names = pd.Index(nodes['name']).drop_duplicates()
+        edges = np.stack([names.get_indexer(links['source']), names.get_indexer(links['target'])], axis=1)
+        first = nodes.drop_duplicates(subset='name')
+        if layout == 'layered':
+            x, y = _layered_layout(first['category'].to_numpy(), edges)
+        else:
+            x, y = _force_layout(len(first), edges)
+        position = pd.DataFrame({'x': x * 2000, 'y': y * 1000}, index=names)
+        nodes = nodes.join(position, on='name')
+        options = {'layout': 'none', 'is_layout_animation': False}
+
+    Graph(init_opts=opts.InitOpts(width="2400px", height="1200px",
+                                  animation_opts=opts.AnimationOpts(animation=layout == 'circular'))) \
         .add(
         '',
-        nodes=nodes,
-        links=edges,
+        nodes=nodes.to_dict(orient='records'),
+        links=links.to_dict(orient='records'),
         categories=categories,
-        repulsion=8000,
-        layout="circular",
         is_rotate_label=True,
         linestyle_opts=opts.LineStyleOpts(color="source", curve=0.3),
-        label_opts=opts.LabelOpts(position="right")
+        label_opts=opts.LabelOpts(position="right"),
+        **options
     ) \
         .set_global_opts(
         title_opts=opts.TitleOpts(title=''),
@@ -153,6 +239,65 @@ def vis(tcm, tcm_chem_links, chem, chem_protein_links, protein, path='result'):
         .render(path=os.path.join(path, "Graph.html"))
 
 
+def _layered_layout(layers, edges):
+    # 分层布局：同一层的节点位于同一列；除第0层外，各层节点按其在上一层的邻居的平均纵坐标排序，以减少连线交叉
+    x = layers / max(layers.max(initial=0), 1)
+    y = np.zeros(len(layers))
+    for layer in np.unique(layers):
+        members = np.flatnonzero(layers == layer)
+        order = np.zeros(len(layers))
+        if layer > 0:
+            # 各节点在上一层的邻居的平均纵坐标（连接不区分方向）
+            pairs = np.concatenate([edges, edges[:, ::-1]])
+            pairs = pairs[(layers[pairs[:, 0]] == layer) & (layers[pairs[:, 1]] == layer - 1)]
+            total = np.bincount(pairs[:, 0], weights=y[pairs[:, 1]], minlength=len(layers))
+            count = np.bincount(pairs[:, 0], minlength=len(layers))
+            order = np.divide(total, count, out=np.zeros(len(layers)), where=count > 0)
+        members = members[np.argsort(order[members], kind='stable')]
+        y[members] = (np.arange(len(members)) + 0.5) / len(members)
+    return x, y
+
+
+def _force_layout(n, edges, iterations=50, exact=1000, grid=16, random_state=0):
+    # Fruchterman-Reingold力导向布局：节点之间相互排斥，连接的两端相互吸引，移动距离随迭代逐渐减小；
+    # 节点数不超过exact时逐对计算排斥力，否则将节点按坐标分入grid * grid个格子，以各格子的重心近似计算排斥力
+    rng = np.random.default_rng(random_state)
+    position = rng.random((n, 2))
+    k2 = 1 / max(n, 1)
+    temperature = 0.1
+    for _ in range(iterations):
+        if n <= exact:
+            sources, weights = position, np.ones(n)
+        else:
+            cell = np.minimum((position * grid).astype(int), grid - 1)
+            cell = cell[:, 0] * grid + cell[:, 1]
+            weights = np.bincount(cell, minlength=grid * grid).astype(float)
+            sources = np.stack([np.bincount(cell, position[:, 0], grid * grid),
+                                np.bincount(cell, position[:, 1], grid * grid)], axis=1)
+            occupied = weights > 0
+            sources, weights = sources[occupied] / weights[occupied, None], weights[occupied]
+
+        delta = position[:, None, :] - sources[None, :, :]
+        distance2 = np.maximum(np.einsum('ijk,ijk->ij', delta, delta), 1e-9)
+        displacement = np.einsum('ijk,ij->ik', delta, k2 * weights / distance2)
+
+        delta = position[edges[:, 0]] - position[edges[:, 1]]
+        force = delta * (np.sqrt(np.einsum('ij,ij->i', delta, delta) / k2))[:, None]
+        np.add.at(displacement, edges[:, 0], -force)
+        np.add.at(displacement, edges[:, 1], force)
+
+        length = np.maximum(np.sqrt(np.einsum('ij,ij->i', displacement, displacement)), 1e-9)
+        position += displacement * (np.minimum(length, temperature) / length)[:, None]
+        position = np.clip(position, 0, 1)
+        temperature -= 0.1 / (iterations + 1)
+
+    # 缩放至[0, 1]
+    if n:
+        position -= position.min(axis=0)
+        position /= np.maximum(position.max(axis=0), 1e-9)
+    return position[:, 0], position[:, 1]
+
+
 if __name__ == '__main__':
     import get
 
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from herbiv import dataset
+
+
+def test_snapshot_numeric_columns_are_memory_mapped(tmp_path, monkeypatch):
+    # 快照中的数值列应直接使用内存映射的数组（多个进程共享页缓存），而不是复制到进程的私有内存中
+    pd.DataFrame({'HVCID': ['HVC0000', 'HVC0001', 'HVC0001'],
+                  'Ensembl_ID': ['ENSP00000000001', 'ENSP00000000001', 'ENSP00000000002'],
+                  'Combined_score': [900, 400, 150]}).to_csv(
+        os.path.join(tmp_path, dataset.DATASETS['chem_protein_links']), index=False)
+
+    # 记录读取快照时映射的各数组
+    mapped = {}
+    load_array = dataset._load_array
+
+    def record(path):
+        mapped[os.path.basename(path)] = array = load_array(path)
+        return array
+
+    dataset.set_data_dir(str(tmp_path))
+    try:
+        dataset.compile_snapshot()
+        monkeypatch.setattr(dataset, '_load_array', record)
+        table = dataset.load('chem_protein_links')
+
+        info = dataset._snapshot_info('chem_protein_links')
+        file, = next(col for col in info['columns'] if col['name'] == 'Combined_score')['files']
+        assert isinstance(mapped[file], np.memmap)
+        assert np.shares_memory(table['Combined_score'].to_numpy(), mapped[file])
+        assert table['Combined_score'].tolist() == [900, 400, 150]
+    finally:
+        dataset.set_data_dir()